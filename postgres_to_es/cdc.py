@@ -0,0 +1,134 @@
+import json
+import logging
+import select
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Optional
+
+import backoff
+import psycopg2
+from psycopg2 import sql
+from queries import (CHANGE_TRACKED_TABLES, SQL_INSTALLED_CHANGE_TRIGGERS,
+                     format_sql_for_change_triggers)
+
+logger = logging.getLogger(__name__)
+
+# Изменение (в том числе удаление) связи фильма с жанром или персоной
+# затрагивает только фильм: документы жанров и персон не содержат списков
+# фильмов, а пересчёт всех фильмов жанра или персоны был бы лишним.
+LINK_TABLES = {
+    "genre_film_work": ("film_work", "film_work_id"),
+    "person_film_work": ("film_work", "film_work_id"),
+}
+
+
+class ChangeSet:
+    """Идентификаторы изменённых и удалённых записей по таблицам."""
+
+    def __init__(self, resync: bool = False):
+        self.updated = defaultdict(set)
+        self.deleted = defaultdict(set)
+        self.oldest_change: Optional[datetime] = None
+        # Уведомления могли быть потеряны, нужен полный проход по updated_at
+        self.resync = resync
+
+    def __bool__(self) -> bool:
+        return self.resync or any(self.updated.values()) or any(self.deleted.values())
+
+    def add(self, payload: dict) -> None:
+        """Учесть уведомление об изменении строки."""
+        table = payload["table"]
+        if table in LINK_TABLES:
+            related_table, column = LINK_TABLES[table]
+            self.updated[related_table].add(payload[column])
+        elif payload["op"] == "DELETE":
+            self.deleted[table].add(payload["id"])
+        else:
+            self.updated[table].add(payload["id"])
+
+        changed_at = datetime.fromtimestamp(payload["changed_at"], timezone.utc)
+        if self.oldest_change is None or changed_at < self.oldest_change:
+            self.oldest_change = changed_at
+
+    def updated_ids(self, table: str) -> tuple:
+        """Изменённые и не удалённые после этого записи таблицы."""
+        return tuple(self.updated.get(table, set()) - self.deleted.get(table, set()))
+
+    def deleted_ids(self, table: str) -> tuple:
+        return tuple(self.deleted.get(table, ()))
+
+
+class ChangeListener:
+    """
+    Источник изменений на основе триггеров и LISTEN/NOTIFY.
+    Триггеры на таблицах контента отправляют идентификаторы изменённых
+    и удалённых строк в канал, слушатель собирает их в ChangeSet.
+    Уведомления, отправленные пока слушатель не подключён, теряются,
+    поэтому после переподключения нужен полный проход по updated_at.
+    """
+
+    def __init__(self, dsn: dict, channel: str, debounce: float = 0.5):
+        self.dsn = dsn
+        self.channel = channel
+        self.debounce = debounce
+        self.connection = None
+
+    @backoff.on_exception(backoff.expo, psycopg2.OperationalError)
+    def connect(self) -> None:
+        """Подключение к Postgres, установка триггеров и подписка на канал."""
+        self.connection = psycopg2.connect(**self.dsn)
+        self.connection.autocommit = True
+        with self.connection.cursor() as cursor:
+            self._install_triggers(cursor)
+            cursor.execute(sql.SQL("listen {};").format(sql.Identifier(self.channel)))
+        logger.info("Listening for changes on channel %s", self.channel)
+
+    def _install_triggers(self, cursor) -> None:
+        """
+        Установка триггеров на таблицы, где их ещё нет. Пересоздавать
+        существующие при каждом переподключении не нужно: это берёт
+        блокировку таблиц и мешает записи в них.
+        """
+        cursor.execute(
+            SQL_INSTALLED_CHANGE_TRIGGERS, (list(CHANGE_TRACKED_TABLES), self.channel)
+        )
+        installed = {row[0] for row in cursor.fetchall()}
+        missing = [table for table in CHANGE_TRACKED_TABLES if table not in installed]
+        if missing:
+            cursor.execute(format_sql_for_change_triggers(self.channel, missing))
+            logger.info("Installed change triggers on %s", ", ".join(missing))
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+
+    def wait(self, timeout: float) -> ChangeSet:
+        """
+        Дождаться изменений, но не дольше timeout секунд.
+        После первого уведомления ещё debounce секунд собираются следующие,
+        чтобы обработать их одной пачкой.
+        """
+        try:
+            return self._wait(timeout)
+        except psycopg2.OperationalError:
+            logger.exception("Lost connection to Postgres, reconnecting")
+            self.close()
+            self.connect()
+            return ChangeSet(resync=True)
+
+    def _wait(self, timeout: float) -> ChangeSet:
+        changes = ChangeSet()
+        if not select.select([self.connection], [], [], timeout)[0]:
+            return changes
+
+        deadline = time.monotonic() + self.debounce
+        while True:
+            self.connection.poll()
+            while self.connection.notifies:
+                notify = self.connection.notifies.pop(0)
+                changes.add(json.loads(notify.payload))
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return changes
+            select.select([self.connection], [], [], remaining)
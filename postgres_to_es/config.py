@@ -35,3 +35,42 @@ class ElasticSearchSettings(EnvPrioritySettings):
 
     host: str = Field(..., env="ELASTIC_HOST")
     port: str = Field(..., env="ELASTIC_PORT")
+
+
+class RedisSettings(EnvPrioritySettings):
+    """Валидация для подключения к Redis, куда публикуются изменения."""
+
+    host: str = Field(..., env="REDIS_HOST")
+    port: int = Field(6379, env="REDIS_PORT")
+    stream: str = Field("etl:changes", env="CACHE_INVALIDATION_STREAM")
+    maxlen: int = Field(10000, env="CACHE_INVALIDATION_STREAM_MAXLEN")
+
+
+class ETLSettings(EnvPrioritySettings):
+    """Размеры пачек и параллельность конвейера ETL."""
+
+    batch_size: int = Field(100, env="ETL_BATCH_SIZE")
+    round_size: int = Field(1000, env="ETL_ROUND_SIZE")
+    itersize: int = Field(2000, env="ETL_ITERSIZE")
+    server_side_cursors: bool = Field(True, env="ETL_SERVER_SIDE_CURSORS")
+    copy_full_load: bool = Field(False, env="ETL_COPY_FULL_LOAD")
+    rebuild: bool = Field(False, env="ETL_REBUILD")
+    queue_size: int = Field(4, env="ETL_QUEUE_SIZE")
+    transform_workers: int = Field(1, env="ETL_TRANSFORM_WORKERS")
+    load_workers: int = Field(2, env="ETL_LOAD_WORKERS")
+    parallel_processors: bool = Field(False, env="ETL_PARALLEL_PROCESSORS")
+    bulk_concurrency: int = Field(4, env="ETL_BULK_CONCURRENCY")
+    bulk_chunk_size: int = Field(500, env="ETL_BULK_CHUNK_SIZE")
+    bulk_max_chunk_bytes: int = Field(10 * 1024 * 1024, env="ETL_BULK_MAX_CHUNK_BYTES")
+    bulk_max_retries: int = Field(5, env="ETL_BULK_MAX_RETRIES")
+    bulk_initial_backoff: float = Field(1, env="ETL_BULK_INITIAL_BACKOFF")
+    bulk_max_backoff: float = Field(60, env="ETL_BULK_MAX_BACKOFF")
+    dead_letter_file: str = Field("state/dead_letter.jsonl", env="ETL_DEAD_LETTER_FILE")
+    lock_file: str = Field("state/etl.lock", env="ETL_LOCK_FILE")
+    daemon: bool = Field(False, env="ETL_DAEMON")
+    poll_min_interval: float = Field(1, env="ETL_POLL_MIN_INTERVAL")
+    poll_max_interval: float = Field(60, env="ETL_POLL_MAX_INTERVAL")
+    metrics_port: int = Field(0, env="ETL_METRICS_PORT")
+    cdc_enabled: bool = Field(False, env="ETL_CDC_ENABLED")
+    cdc_channel: str = Field("etl_changes", env="ETL_CDC_CHANNEL")
+    cdc_debounce: float = Field(0.5, env="ETL_CDC_DEBOUNCE")
@@ -1,31 +1,301 @@
 import json
 import logging
+import threading
+import time
+from typing import Optional, Tuple
 
 import backoff
-from elasticsearch import Elasticsearch, TransportError
-from elasticsearch.helpers import bulk
+from config import ETLSettings
+from elasticsearch import ConnectionError, Elasticsearch, TransportError
+from elasticsearch.helpers import bulk, expand_action, streaming_bulk
 
 logger = logging.getLogger(__name__)
 
+# Настройки индекса на время полной загрузки
+INGEST_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": 0}
+FORCEMERGE_TIMEOUT = 60 * 60
+# Ошибки документов, после которых имеет смысл повторить попытку
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Сколько секунд повторять запрос, отклонённый целиком, прежде чем сдаться:
+# дальше ошибку обрабатывает цикл ETL
+RETRY_MAX_TIME = 10 * 60
+# Сколько разных значений поля собирает delete_by_field у удаляемых документов
+COLLECT_MAX_VALUES = 10000
+
+
+def is_permanent_error(error: TransportError) -> bool:
+    """
+    Ошибка запроса целиком, которую нет смысла повторять. Повторяются сбои
+    соединения, 429 и ответы 5xx.
+    """
+    if isinstance(error, ConnectionError):
+        return False
+    status = error.status_code
+    return not (status in RETRY_STATUSES or (isinstance(status, int) and status >= 500))
+
+
+class DeadLetterFile:
+    """Файл для документов, которые не удалось загрузить: по json в строке."""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+
+    def write(self, index_name: str, errors: list, documents: dict) -> None:
+        lines = [
+            json.dumps(
+                {
+                    "index": index_name,
+                    "id": error.get("_id"),
+                    "status": error.get("status"),
+                    "error": error.get("error"),
+                    "document": documents.get(str(error.get("_id"))),
+                },
+                ensure_ascii=False,
+                default=str,
+            )
+            for error in errors
+        ]
+        with self.lock, open(self.file_path, "a") as fp:
+            fp.write("\n".join(lines) + "\n")
+
 
 class ElasticSearchLoader:
     """Класс загрузки данных в ElasticSearch."""
 
-    def __init__(self, connection: dict):
+    def __init__(self, connection: dict, settings: Optional[ETLSettings] = None):
+        settings = settings or ETLSettings()
         self.es = Elasticsearch([connection])
+        # Общий для всех процессов ETL лимит одновременных bulk-запросов
+        self.bulk_slots = threading.BoundedSemaphore(settings.bulk_concurrency)
+        self.chunk_size = settings.bulk_chunk_size
+        self.max_chunk_bytes = settings.bulk_max_chunk_bytes
+        self.max_retries = settings.bulk_max_retries
+        self.initial_backoff = settings.bulk_initial_backoff
+        self.max_backoff = settings.bulk_max_backoff
+        self.dead_letter = DeadLetterFile(settings.dead_letter_file)
 
     @backoff.on_exception(backoff.expo, TransportError)
     def create_index(self, index_name, index_scheme) -> None:
-        """Создание индекса в ES."""
+        """
+        Создание индекса в ES.
+        Индекс создаётся как первая версия index_name_v1 с алиасом index_name,
+        чтобы его можно было перестроить без простоя (см. rebuild_index).
+        """
 
         if not self.es.indices.exists(index=index_name):
-            with open(index_scheme) as fp:
-                index_body = json.load(fp)
-            self.es.indices.create(index=index_name, body=index_body)
-            logger.info("Created index %s", index_name)
+            # Индекс создаётся сразу с алиасом: при повторе после сбоя алиас
+            # уже есть, и лишняя версия без алиаса не появится.
+            version = self._create_version(index_name, index_scheme, alias=index_name)
+            logger.info("Created index %s with alias %s", version, index_name)
+
+    @staticmethod
+    def _read_scheme(index_scheme) -> dict:
+        with open(index_scheme) as fp:
+            return json.load(fp)
+
+    def _versions(self, index_name) -> dict:
+        """Версии индекса: номер версии -> имя индекса."""
+        indices = self.es.indices.get(index=f"{index_name}_v*", ignore_unavailable=True)
+        versions = {}
+        for name in indices:
+            suffix = name[len(index_name) + 2 :]
+            if suffix.isdigit():
+                versions[int(suffix)] = name
+        return versions
 
     @backoff.on_exception(backoff.expo, TransportError)
-    def load_es_data(self, data: list, index_name) -> None:
-        """Загрузка данных в ES."""
+    def create_index_version(self, index_name, index_scheme, ingest=False) -> str:
+        """
+        Создание следующей версии индекса index_name_v{n} без алиаса.
+        ingest=True - настройки для быстрой загрузки: без обновления
+        поиска и без реплик, их восстанавливает finish_ingest.
+        Версия, созданная попыткой, которая завершилась по таймауту,
+        остаётся без алиаса и удаляется при переключении алиаса.
+        """
+
+        return self._create_version(index_name, index_scheme, ingest=ingest)
+
+    def _create_version(
+        self, index_name, index_scheme, ingest=False, alias=None
+    ) -> str:
+        """
+        Создание следующей версии индекса без повторов.
+        alias - алиас, который создаётся вместе с индексом. Повторять такой
+        запрос здесь нельзя: после таймаута индекс мог быть создан, и повтор
+        создал бы ещё одну версию с тем же алиасом. Повторяет create_index,
+        предварительно проверив, не появился ли алиас.
+        """
+
+        versions = self._versions(index_name)
+        version = f"{index_name}_v{max(versions, default=0) + 1}"
+        index_body = self._read_scheme(index_scheme)
+        if ingest:
+            index_body.setdefault("settings", {}).update(INGEST_SETTINGS)
+        if alias:
+            index_body["aliases"] = {alias: {}}
+        self.es.indices.create(index=version, body=index_body)
+        return version
+
+    @backoff.on_exception(backoff.expo, TransportError)
+    def finish_ingest(self, version, index_scheme) -> None:
+        """
+        Возврат настроек индекса после загрузки: значения из схемы,
+        а если их там нет - значения ES по умолчанию. Затем сегменты
+        сливаются, пока в индекс никто не пишет.
+        """
+
+        scheme_settings = self._read_scheme(index_scheme).get("settings", {})
+        settings = {name: scheme_settings.get(name) for name in INGEST_SETTINGS}
+        self.es.indices.put_settings(index=version, body={"index": settings})
+        self.es.indices.refresh(index=version)
+        self.es.indices.forcemerge(
+            index=version, max_num_segments=1, request_timeout=FORCEMERGE_TIMEOUT
+        )
+
+    @backoff.on_exception(backoff.expo, TransportError)
+    def swap_alias(self, index_name, version) -> None:
+        """
+        Атомарное переключение алиаса index_name на новую версию индекса.
+        Предыдущая версия остаётся для отката, более старые удаляются.
+        Индекс без версий, созданный до появления алиасов, удаляется
+        в том же запросе, чтобы его имя занял алиас.
+        """
+
+        actions = [{"add": {"index": version, "alias": index_name}}]
+        current = []
+        if self.es.indices.exists_alias(name=index_name):
+            current = list(self.es.indices.get_alias(name=index_name))
+            actions.insert(0, {"remove": {"index": "*", "alias": index_name}})
+        elif self.es.indices.exists(index=index_name):
+            actions.insert(0, {"remove_index": {"index": index_name}})
+        self.es.indices.update_aliases(body={"actions": actions})
+        logger.info("Alias %s switched to %s", index_name, version)
+
+        for name in self._versions(index_name).values():
+            if name != version and name not in current:
+                self.es.indices.delete(index=name)
+                logger.info("Deleted old index %s", name)
+
+    @backoff.on_exception(
+        backoff.expo,
+        TransportError,
+        giveup=is_permanent_error,
+        max_time=RETRY_MAX_TIME,
+    )
+    def load_es_data(self, data: list, index_name) -> Tuple[int, int]:
+        """
+        Загрузка данных в ES частями, ограниченными по числу документов и байтам.
+        Повторно, с нарастающей паузой, отправляются только документы, которые
+        ES не принял по временной причине (429 и 5xx). Пауза выдерживается
+        без занятого слота bulk_slots, а сам streaming_bulk не повторяет
+        запросы, чтобы не было второго слоя повторов. Запрос, отклонённый
+        целиком с 429 или 5xx, повторяется полностью, но не дольше
+        RETRY_MAX_TIME. Документы с постоянной ошибкой и не загруженные после
+        всех попыток пишутся в dead letter файл.
+        Возвращает число загруженных документов и объём отправленных данных.
+        """
+
+        documents = {str(d["_id"]): d for d in data}
+        sent_bytes = 0
+        loaded = 0
+
+        def _expand(document: dict) -> tuple:
+            # Документ сериализуется один раз, заодно считается объём данных
+            nonlocal sent_bytes
+            action, source = expand_action(document)
+            source = self.es.transport.serializer.dumps(source)
+            sent_bytes += len(source.encode())
+            return action, source
+
+        pending = list(data)
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(
+                    min(self.max_backoff, self.initial_backoff * 2 ** (attempt - 1))
+                )
+            failed = []
+            with self.bulk_slots:
+                for ok, item in streaming_bulk(
+                    self.es,
+                    pending,
+                    index=index_name,
+                    chunk_size=self.chunk_size,
+                    max_chunk_bytes=self.max_chunk_bytes,
+                    expand_action_callback=_expand,
+                    raise_on_error=False,
+                    max_retries=0,
+                ):
+                    if ok:
+                        loaded += 1
+                    else:
+                        failed.append(next(iter(item.values())))
+
+            retry, rejected = [], []
+            for error in failed:
+                if error.get("status") in RETRY_STATUSES:
+                    retry.append(error)
+                else:
+                    rejected.append(error)
+            self._dead_letter(index_name, rejected, documents)
+            if not retry:
+                break
+            if attempt == self.max_retries:
+                self._dead_letter(index_name, retry, documents)
+                break
+            pending = [documents[str(e["_id"])] for e in retry]
+        return loaded, sent_bytes
+
+    def _dead_letter(self, index_name, errors: list, documents: dict) -> None:
+        if not errors:
+            return
+        logger.error(
+            "%d document(s) failed to load into %s, first error: %s",
+            len(errors),
+            index_name,
+            errors[0].get("error"),
+        )
+        self.dead_letter.write(index_name, errors, documents)
+
+    @backoff.on_exception(backoff.expo, TransportError)
+    def delete_es_data(self, ids: tuple, index_name) -> None:
+        """Удаление документов из ES. Отсутствующие документы пропускаются."""
+
+        actions = ({"_op_type": "delete", "_id": _id} for _id in ids)
+        with self.bulk_slots:
+            _, errors = bulk(self.es, actions, index=index_name, raise_on_error=False)
+        for error in errors:
+            if error["delete"]["status"] != 404:
+                logger.error("Failed to delete document: %s", error)
+
+    @backoff.on_exception(
+        backoff.expo,
+        TransportError,
+        giveup=is_permanent_error,
+        max_time=RETRY_MAX_TIME,
+    )
+    def delete_by_field(
+        self, index_name, field, values, keep_ids=(), collect=None
+    ) -> list:
+        """
+        Удаление документов, у которых field равно одному из values, кроме keep_ids.
+        collect - поле, значения которого у удаляемых документов нужно вернуть,
+        например, чтобы сообщить об их удалении.
+        """
 
-        bulk(self.es, data, index=index_name)
+        query = {"bool": {"filter": {"terms": {field: list(values)}}}}
+        if keep_ids:
+            query["bool"]["must_not"] = {"ids": {"values": list(keep_ids)}}
+        collected = []
+        if collect:
+            aggs = {"values": {"terms": {"field": collect, "size": COLLECT_MAX_VALUES}}}
+            response = self.es.search(
+                index=index_name, body={"query": query, "size": 0, "aggs": aggs}
+            )
+            buckets = response["aggregations"]["values"]["buckets"]
+            collected = [bucket["key"] for bucket in buckets]
+        with self.bulk_slots:
+            self.es.delete_by_query(
+                index=index_name, body={"query": query}, conflicts="proceed"
+            )
+        return collected
@@ -1,18 +1,26 @@
 import abc
 import logging
+import threading
 from datetime import datetime
-from typing import Generator
+from typing import Generator, Iterable, Optional
 
+from cdc import ChangeSet
+from config import ETLSettings
+from pipeline import Pipeline
 from ps_extractor import PostgresExtractor
+from publisher import ChangePublisher
 from queries import (format_sql_for_all_filmworks, format_sql_for_all_genres,
+                     format_sql_for_all_person_films,
                      format_sql_for_all_persons,
-                     format_sql_for_related_filmwork,
-                     format_sql_for_related_person)
+                     format_sql_for_related_filmwork)
 from state import JsonFileStorage, State
-from transformer import get_ids_list, transform_data
+from transformer import add_suggest, get_ids_list, transform_data
 
 logger = logging.getLogger(__name__)
 
+# id для водяного знака, который меньше любого настоящего
+NIL_ID = "00000000-0000-0000-0000-000000000000"
+
 
 class ETLProcessor(abc.ABC):
     """
@@ -24,35 +32,242 @@ class ETLProcessor(abc.ABC):
     tables: dict
     state_file: str
 
-    def __init__(self, es, pg_connection):
+    def __init__(
+        self,
+        es,
+        pg_connection,
+        publisher: Optional[ChangePublisher] = None,
+        settings: Optional[ETLSettings] = None,
+    ):
+        settings = settings or ETLSettings()
         self.es = es
-        self.extractor = PostgresExtractor(pg_connection)
+        self.publisher = publisher
+        self.extractor = PostgresExtractor(
+            pg_connection,
+            settings.batch_size,
+            settings.itersize,
+            settings.server_side_cursors,
+        )
+        self.copy_full_load = settings.copy_full_load
+        self.round_size = settings.round_size
         self.state_storage = State(JsonFileStorage(self.state_file))
         self.index_scheme = f"es_indexes/{self.index_name}.json"
+        self.index_ready = False
+        # Индекс, в который пишутся документы: алиас index_name
+        # или новая версия индекса во время перестроения
+        self.target_index = self.index_name
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.pipeline = Pipeline(
+            self.transform_data,
+            self.load_data,
+            queue_size=settings.queue_size,
+            transform_workers=settings.transform_workers,
+            load_workers=settings.load_workers,
+        )
 
-    def process(self):
-        """Метод для переноса данных."""
-        logger.info("Checking available indexes")
-        self.es.create_index(self.index_name, self.index_scheme)
-        logger.info("Grabbing data")
+    def process(self) -> dict:
+        """
+        Метод для переноса данных.
+        Возвращает число загруженных документов и задержку синхронизации:
+        сколько секунд самое старое изменение из этого прохода ждало загрузки.
+        """
+        self.prepare()
+        first_run = self.state_storage.get_state(self.main_table) is None
+        if self.copy_full_load and first_run:
+            return self.process_full()
+
+        watermarks = {table: self.get_watermark(table) for table in self.tables}
+        pending = list(self.tables)
+        while pending:
+            # Раунд: из каждой таблицы берётся до round_size изменённых записей
+            # после её водяного знака. Каждый документ извлекается и загружается
+            # один раз за раунд, сколько бы изменённых записей из разных таблиц
+            # на него ни ссылалось. Водяные знаки сохраняются после загрузки
+            # раунда, поэтому после сбоя работа продолжается с последнего раунда.
+            dirty_ids = set()
+            for table in list(pending):
+                updated_ids = self.extractor.extract_updated_ids(
+                    table, watermarks[table], self.round_size
+                )
+                if len(updated_ids) < self.round_size:
+                    pending.remove(table)
+                if not updated_ids:
+                    continue
+                self.track_oldest_change(updated_ids)
+                dirty_ids.update(
+                    self.resolve_ids(get_ids_list(updated_ids), self.tables[table])
+                )
+                last_id, last_updated_at = updated_ids[-1][0], updated_ids[-1][1]
+                watermarks[table] = (last_updated_at, last_id)
+
+            logger.info(
+                "%d documents to update in index %s", len(dirty_ids), self.index_name
+            )
+            self.pipeline.run(self.extract_documents(tuple(sorted(dirty_ids))))
+            self.set_watermarks(watermarks)
+        logger.info("New data added to index %s", self.index_name)
+        return self.result()
+
+    def process_full(self) -> dict:
+        """
+        Первая полная загрузка индекса через COPY, без выборки id
+        изменённых записей.
+        """
+        logger.info("Full load of index %s", self.index_name)
+        # Изменения, сделанные во время загрузки, попадут в следующий проход
+        started = datetime.now()
+        self.pipeline.run(self.count_documents(self.extract_full_data()))
+        self.set_watermarks({table: (started, NIL_ID) for table in self.tables})
+        logger.info("New data added to index %s", self.index_name)
+        return self.result()
+
+    def rebuild(self) -> dict:
+        """
+        Перестроение индекса без простоя: все документы загружаются в новую
+        версию индекса, после чего на неё атомарно переключается алиас.
+        API всё это время читает предыдущую версию через алиас.
+        """
+        self.stats = self.empty_stats()
+        # Изменения, сделанные во время перестроения, попадут в следующий проход
+        started = datetime.now()
+        version = self.es.create_index_version(
+            self.index_name, self.index_scheme, ingest=True
+        )
+        logger.info("Rebuilding index %s into %s", self.index_name, version)
+        self.target_index = version
+        try:
+            self.pipeline.run(self.count_documents(self.extract_full_data()))
+        finally:
+            self.target_index = self.index_name
+        self.es.finish_ingest(version, self.index_scheme)
+        self.es.swap_alias(self.index_name, version)
+        self.index_ready = True
+        self.set_watermarks({table: (started, NIL_ID) for table in self.tables})
+        return self.result()
+
+    def get_watermark(self, table: str) -> tuple:
+        """
+        Водяной знак таблицы: (updated_at, id) последней загруженной записи.
+        Состояние старого формата - строка с датой - читается как дата без id.
+        """
+        state = self.state_storage.get_state(table)
+        if state is None:
+            return datetime.min, NIL_ID
+        if isinstance(state, str):
+            return state, NIL_ID
+        return state["updated_at"], state["id"]
+
+    def set_watermarks(self, watermarks: dict) -> None:
+        """Сохранение водяных знаков всех таблиц одной записью."""
+        self.state_storage.set_states(
+            {
+                table: {"updated_at": str(updated_at), "id": str(last_id)}
+                for table, (updated_at, last_id) in watermarks.items()
+            }
+        )
+
+    def process_changes(self, changes: ChangeSet) -> dict:
+        """
+        Перенос данных по изменениям из ChangeListener без сканирования таблиц.
+        Документы удалённых записей удаляются из индекса.
+        """
+        self.prepare()
+        self.stats["oldest_change"] = changes.oldest_change
+        dirty_ids = set()
         for table, related in self.tables.items():
-            last_date = self.state_storage.get_state(table) or datetime.min
+            dirty_ids.update(self.resolve_ids(changes.updated_ids(table), related))
+        self.pipeline.run(self.extract_documents(tuple(sorted(dirty_ids))))
+        deleted_ids = changes.deleted_ids(self.main_table)
+        if deleted_ids:
+            self.delete_data(deleted_ids)
+        logger.info("Changes applied to index %s", self.index_name)
+        return self.result()
+
+    @property
+    def main_table(self) -> str:
+        """Таблица, записи которой соответствуют документам индекса."""
+        return next(table for table, related in self.tables.items() if not related)
+
+    def prepare(self) -> None:
+        """Проверка индекса при первом проходе и сброс статистики прохода."""
+        if not self.index_ready:
+            logger.info("Checking available indexes")
+            self.es.create_index(self.index_name, self.index_scheme)
+            self.index_ready = True
+        logger.info("Grabbing data")
+        self.stats = self.empty_stats()
 
-            for updated_ids in self.extractor.extract_updated_ids(table, last_date):
+    @staticmethod
+    def empty_stats() -> dict:
+        return {"documents": 0, "loaded": 0, "bytes": 0, "oldest_change": None}
 
-                updated_ids_list = get_ids_list(updated_ids)
-                if related:
-                    updated_ids = self.extract_related_ids(*related, updated_ids_list)
-                    updated_ids_list = get_ids_list(updated_ids)
-                for data in self.extract_all_data(updated_ids_list):
-                    transformed_data = self.transform_data(data)
-                    self.es.load_es_data(transformed_data, self.index_name)
+    def result(self) -> dict:
+        """
+        Число извлечённых и загруженных документов, объём загруженных данных
+        и задержка синхронизации прохода.
+        """
+        oldest_change = self.stats["oldest_change"]
+        lag = 0.0
+        if oldest_change is not None:
+            lag = (datetime.now(oldest_change.tzinfo) - oldest_change).total_seconds()
+        return {
+            "documents": self.stats["documents"],
+            "loaded": self.stats["loaded"],
+            "bytes": self.stats["bytes"],
+            "lag": lag,
+        }
 
-            self.state_storage.set_state(
-                table, datetime.now().strftime("%Y-%m-%d, %H:%M:%S")
+    def resolve_ids(self, ids: tuple, related: Optional[tuple]) -> tuple:
+        """Идентификаторы документов индекса по id изменённых записей таблицы."""
+        if not related:
+            return ids
+        related_ids = []
+        batch_size = self.extractor.batch_size
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start : start + batch_size]
+            related_ids.extend(get_ids_list(self.extract_related_ids(*related, chunk)))
+        return tuple(related_ids)
+
+    def extract_documents(self, ids: tuple) -> Generator:
+        """Извлечение пачек документов по их идентификаторам."""
+        batch_size = self.extractor.batch_size
+        for start in range(0, len(ids), batch_size):
+            yield from self.count_documents(
+                self.extract_all_data(ids[start : start + batch_size])
             )
-            logger.info("New data added from table %s", table)
-        logger.info("New data added to index %s", self.index_name)
+
+    def count_documents(self, batches: Generator) -> Generator:
+        """Подсчёт извлечённых документов для статистики прохода."""
+        for data in batches:
+            self.stats["documents"] += len(data)
+            yield data
+
+    def track_oldest_change(self, updated_ids: list) -> None:
+        """Запомнить самое раннее updated_at среди изменений прохода."""
+        oldest = min(row[1] for row in updated_ids)
+        current = self.stats["oldest_change"]
+        if current is None or oldest < current:
+            self.stats["oldest_change"] = oldest
+
+    def load_data(self, transformed_data: list) -> None:
+        """Загрузка пачки в ES и публикация изменённых id."""
+        loaded, sent_bytes = self.es.load_es_data(transformed_data, self.target_index)
+        with self.stats_lock:
+            self.stats["loaded"] += loaded
+            self.stats["bytes"] += sent_bytes
+        if self.publisher:
+            self.publisher.publish(self.index_name, self.changed_ids(transformed_data))
+
+    def changed_ids(self, documents: list) -> Iterable[str]:
+        """Идентификаторы, по которым API инвалидирует кеш после загрузки."""
+        return (d["_id"] for d in documents)
+
+    def delete_data(self, ids: tuple) -> None:
+        """Удаление документов из ES и публикация удалённых id."""
+        self.es.delete_es_data(ids, self.target_index)
+        if self.publisher:
+            self.publisher.publish(self.index_name, ids)
 
     @abc.abstractmethod
     def extract_related_ids(self, table: str, column: str, related_ids: tuple) -> list:
@@ -64,6 +279,18 @@ class ETLProcessor(abc.ABC):
         """Метод получения всех необходимых данных."""
         pass
 
+    def extract_full_data(self) -> Generator:
+        """Получение всех данных индекса для полной загрузки."""
+        query = self.full_data_query()
+        if self.copy_full_load:
+            return self.extractor.copy_query_generator(query)
+        return self.extractor.execute_query_generator(query)
+
+    @abc.abstractmethod
+    def full_data_query(self) -> str:
+        """Метод получения запроса всех данных индекса."""
+        pass
+
     @abc.abstractmethod
     def transform_data(self, data: list) -> list:
         """Метод для изменения данных под нужную схему."""
@@ -91,33 +318,103 @@ class MoviesETLProcessor(ETLProcessor):
         query = format_sql_for_all_filmworks()
         return self.extractor.execute_query_generator(query, ids)
 
+    def full_data_query(self) -> str:
+        """Запрос данных всех кинолент для полной загрузки."""
+        return format_sql_for_all_filmworks(by_ids=False)
+
     def transform_data(self, data: list) -> list:
         """Изменение данных под схему movies"""
-        return transform_data(data)
+        return add_suggest(transform_data(data), "title", "imdb_rating")
 
 
 class PersonETLProcessor(ETLProcessor):
-    """Конкретный класс для заполнения данных по схеме person."""
+    """
+    Конкретный класс для заполнения данных по схеме person.
+    Фильмы персон загружает PersonFilmsETLProcessor, поэтому изменение
+    фильма не перезаписывает документы персон.
+    """
 
     index_name = "person"
     tables = {
         "person": None,
-        "film_work": ("person_film_work", "film_work_id"),
     }
     state_file = "state/person_state.json"
 
-    def extract_related_ids(self, table: str, column: str, related_ids: tuple) -> list:
-        """Извлечение идентификаторов через связующую таблицу."""
-        query = format_sql_for_related_person(table, column)
-        return self.extractor.execute_query(query, related_ids)
+    def extract_related_ids(self, table: str, column: str, related_ids: tuple) -> None:
+        """Извлечение идентификаторов через связующую таблицу. Не используется."""
+        pass
 
     def extract_all_data(self, ids: tuple) -> Generator:
         """Извлечение данных о персонах по кортежу с id."""
         query = format_sql_for_all_persons()
         return self.extractor.execute_query_generator(query, ids)
 
+    def full_data_query(self) -> str:
+        """Запрос данных всех персон для полной загрузки."""
+        return format_sql_for_all_persons(by_ids=False)
+
     def transform_data(self, data: list) -> list:
         """Изменение данных под схему person."""
+        return add_suggest(transform_data(data), "full_name")
+
+
+class PersonFilmsETLProcessor(ETLProcessor):
+    """
+    Конкретный класс для заполнения индекса связей персон с фильмами.
+    Документы связей строятся по id фильмов: изменение фильма перезаписывает
+    только его связи, а связи, которых больше нет, удаляются.
+    """
+
+    index_name = "person_films"
+    tables = {
+        "film_work": None,
+    }
+    state_file = "state/person_films_state.json"
+
+    def extract_related_ids(self, table: str, column: str, related_ids: tuple) -> None:
+        """Извлечение идентификаторов через связующую таблицу. Не используется."""
+        pass
+
+    def extract_all_data(self, ids: tuple) -> Generator:
+        """Извлечение связей персон с фильмами по кортежу с id фильмов."""
+        query = format_sql_for_all_person_films()
+        relation_ids = []
+        for data in self.extractor.execute_query_generator(query, ids):
+            relation_ids.extend(row["_id"] for row in data)
+            yield data
+        # Удаление не затрагивает актуальные связи, поэтому порядок
+        # относительно их загрузки в конвейере не важен.
+        person_ids = self.es.delete_by_field(
+            self.target_index, "film_id", ids, relation_ids, collect="person_id"
+        )
+        self.publish_persons(person_ids)
+
+    def full_data_query(self) -> str:
+        """Запрос всех связей персон с фильмами для полной загрузки."""
+        return format_sql_for_all_person_films(by_ids=False)
+
+    def delete_data(self, ids: tuple) -> None:
+        """Удаление связей удалённых фильмов."""
+        person_ids = self.es.delete_by_field(
+            self.target_index, "film_id", ids, collect="person_id"
+        )
+        self.publish_persons(person_ids)
+
+    def changed_ids(self, documents: list) -> Iterable[str]:
+        """
+        Кроме самих связей - персоны: страницы фильмов персоны помечены
+        её id, а новые связи ни в одну закешированную страницу ещё не входят.
+        """
+        person_ids = {d["person_id"] for d in documents}
+        return [*(d["_id"] for d in documents), *person_ids]
+
+    def publish_persons(self, person_ids: list) -> None:
+        """Публикация персон, у которых удалены связи с фильмами."""
+        if self.publisher:
+            self.publisher.publish(self.index_name, person_ids)
+
+    def transform_data(self, data: list) -> list:
+        """Изменение данных под схему person_films."""
         return transform_data(data)
 
 
@@ -139,6 +436,10 @@ class GenresETLProcessor(ETLProcessor):
         query = format_sql_for_all_genres()
         return self.extractor.execute_query_generator(query, ids)
 
+    def full_data_query(self) -> str:
+        """Запрос данных всех жанров для полной загрузки."""
+        return format_sql_for_all_genres(by_ids=False)
+
     def transform_data(self, data: list) -> list:
         """Изменение данных под схему genres"""
         return transform_data(data)
@@ -1,29 +1,292 @@
+import fcntl
 import logging
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, List, Optional, TextIO
 
 import psycopg2
-from config import ElasticSearchSettings, PostgresSettings
+from cdc import ChangeListener, ChangeSet
+from config import (ElasticSearchSettings, ETLSettings, PostgresSettings,
+                    RedisSettings)
 from es_loader import ElasticSearchLoader
-from etl_process import (GenresETLProcessor, MoviesETLProcessor,
-                         PersonETLProcessor)
+from etl_process import (ETLProcessor, GenresETLProcessor, MoviesETLProcessor,
+                         PersonETLProcessor, PersonFilmsETLProcessor)
+from metrics import POLL_INTERVAL, record_cycle, start_metrics_server
 from psycopg2.extras import DictCursor
+from psycopg2.pool import ThreadedConnectionPool
+from publisher import ChangePublisher
 
 logger = logging.getLogger(__name__)
 
+PROCESSORS = (
+    MoviesETLProcessor,
+    PersonETLProcessor,
+    PersonFilmsETLProcessor,
+    GenresETLProcessor,
+)
+
+
+def run_processor(
+    processor: ETLProcessor, changes: Optional[ChangeSet] = None, rebuild: bool = False
+) -> dict:
+    """
+    Проход ETL по одному индексу: по всем записям, обновлённым после
+    сохранённого состояния, только по переданным изменениям или
+    перестроение индекса целиком.
+    Транзакция завершается после прохода, соединение остаётся открытым.
+    """
+    started = time.monotonic()
+    with processor.extractor.connection:
+        if rebuild:
+            stats = processor.rebuild()
+        elif changes is None:
+            stats = processor.process()
+        else:
+            stats = processor.process_changes(changes)
+    duration = time.monotonic() - started
+    record_cycle(processor.index_name, duration, stats)
+    logger.info(
+        "Index %s: %d documents in %.2fs (%.1f docs/s, %.2f MB/s), lag %.2fs",
+        processor.index_name,
+        stats["loaded"],
+        duration,
+        stats["loaded"] / duration if duration else 0,
+        stats["bytes"] / 2**20 / duration if duration else 0,
+        stats["lag"],
+    )
+    return stats
+
+
+def run_cycle(
+    processors: List[ETLProcessor],
+    executor: Optional[ThreadPoolExecutor] = None,
+    changes: Optional[ChangeSet] = None,
+    rebuild: bool = False,
+) -> int:
+    """Проход ETL по всем индексам. Возвращает число загруженных документов."""
+    if executor is None:
+        results = [
+            run_processor(processor, changes, rebuild) for processor in processors
+        ]
+    else:
+        futures = [
+            executor.submit(run_processor, processor, changes, rebuild)
+            for processor in processors
+        ]
+        # Ждём все проходы, даже если один упал: после ошибки соединения
+        # переоткрываются, и ни один поток не должен ими пользоваться.
+        wait(futures)
+        results = [future.result() for future in futures]
+    return sum(stats["documents"] for stats in results)
+
+
+def reconnect(processors: List[ETLProcessor], reopen: Callable) -> None:
+    """
+    Переоткрыть закрытые соединения с Postgres после сбоя прохода.
+    Обработчики с общим соединением получают одно новое соединение.
+    """
+    reopened = {}
+    for processor in processors:
+        connection = processor.extractor.connection
+        if not connection.closed:
+            continue
+        if id(connection) not in reopened:
+            logger.info(
+                "Reopening Postgres connection of index %s", processor.index_name
+            )
+            reopened[id(connection)] = reopen(connection)
+        processor.extractor.connection = reopened[id(connection)]
+
+
+def run_cycle_safely(
+    processors: List[ETLProcessor],
+    executor,
+    reopen: Callable,
+    changes: Optional[ChangeSet] = None,
+) -> Optional[int]:
+    """
+    Проход ETL в демоне: ошибка прохода не завершает процесс, а логируется,
+    после чего закрытые соединения переоткрываются. None, если проход упал.
+    """
+    try:
+        return run_cycle(processors, executor, changes)
+    except Exception:
+        logger.exception("ETL cycle failed")
+    try:
+        reconnect(processors, reopen)
+    except Exception:
+        logger.exception("Failed to reopen Postgres connection")
+    return None
+
+
+def next_interval(interval: float, documents: int, settings: ETLSettings) -> float:
+    """
+    Интервал до следующего опроса: пока есть изменения, опрашиваем часто,
+    при отсутствии изменений интервал удваивается до максимального.
+    """
+    if documents:
+        return settings.poll_min_interval
+    return min(interval * 2, settings.poll_max_interval)
+
+
+def handle_stop_signals() -> threading.Event:
+    """Событие, которое устанавливается по SIGTERM или SIGINT."""
+    stop = threading.Event()
+
+    def _stop(signum, frame):
+        logger.info("Got signal %s, finishing current cycle", signum)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    return stop
+
+
+def poll(
+    processors: List[ETLProcessor],
+    executor,
+    settings: ETLSettings,
+    reopen: Callable,
+) -> None:
+    """
+    Опрос Postgres в цикле до получения SIGTERM или SIGINT.
+    После упавшего прохода интервал растёт так же, как без изменений.
+    """
+    stop = handle_stop_signals()
+    start_metrics_server(settings.metrics_port)
+
+    interval = settings.poll_min_interval
+    while not stop.is_set():
+        # Состояние сохраняется внутри прохода, поэтому остановка между
+        # проходами не теряет обработанные данные.
+        documents = run_cycle_safely(processors, executor, reopen)
+        interval = next_interval(interval, documents or 0, settings)
+        POLL_INTERVAL.set(interval)
+        stop.wait(interval)
+    logger.info("Stopped")
+
+
+def listen(
+    processors: List[ETLProcessor],
+    executor,
+    settings: ETLSettings,
+    listener: ChangeListener,
+    reopen: Callable,
+) -> None:
+    """
+    Загрузка изменений из уведомлений Postgres до получения SIGTERM или SIGINT.
+    Полный проход по updated_at выполняется при запуске, после переподключения
+    и после упавшего прохода, чтобы подобрать пропущенные изменения.
+    """
+    stop = handle_stop_signals()
+    start_metrics_server(settings.metrics_port)
+
+    listener.connect()
+    try:
+        resync = True
+        interval = settings.poll_min_interval
+        while not stop.is_set():
+            changes = None
+            if not resync:
+                # Короткий таймаут, чтобы вовремя заметить сигнал остановки
+                changes = listener.wait(timeout=1)
+                if not changes:
+                    continue
+                if changes.resync:
+                    changes = None
+            documents = run_cycle_safely(processors, executor, reopen, changes)
+            resync = documents is None
+            if resync:
+                interval = next_interval(interval, 0, settings)
+                stop.wait(interval)
+            else:
+                interval = settings.poll_min_interval
+    finally:
+        listener.close()
+    logger.info("Stopped")
+
+
+def lock_state(lock_file: str) -> TextIO:
+    """
+    Не даёт запустить второй процесс ETL с тем же каталогом состояния.
+    Каждый процесс держит состояние в памяти и перезаписал бы водяные знаки
+    другого: например, демон затёр бы знаки, сохранённые перестроением,
+    а изменения, загруженные им во время перестроения, попали бы только
+    в старую версию индекса. Блокировка снимается при закрытии файла
+    или завершении процесса.
+    """
+    os.makedirs(os.path.dirname(lock_file) or ".", exist_ok=True)
+    fp = open(lock_file, "w")
+    try:
+        fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        fp.close()
+        raise SystemExit(f"Another ETL process is running ({lock_file} is locked)")
+    return fp
+
 
 def etl():
     """Основной процесс получения данных."""
+    settings = ETLSettings()
+    lock = lock_state(settings.lock_file)
     logger.info("Start")
 
     ps_conn = PostgresSettings()
     es_conn = ElasticSearchSettings()
-    es = ElasticSearchLoader(es_conn.dict())
-    with psycopg2.connect(**ps_conn.dict(), cursor_factory=DictCursor) as pg_conn:
-        etl_movies = MoviesETLProcessor(es, pg_conn)
-        etl_movies.process()
-        etl_persons = PersonETLProcessor(es, pg_conn)
-        etl_persons.process()
-        etl_genres = GenresETLProcessor(es, pg_conn)
-        etl_genres.process()
+    es = ElasticSearchLoader(es_conn.dict(), settings)
+    redis_conn = RedisSettings()
+    publisher = ChangePublisher(
+        redis_conn.dict(include={"host", "port"}), redis_conn.stream, redis_conn.maxlen
+    )
+
+    executor = None
+    if settings.parallel_processors:
+        # Индексы заполняются одновременно, каждый на своём соединении и со своим
+        # файлом состояния. Одновременные bulk-запросы ограничивает ElasticSearchLoader.
+        pg_pool = ThreadedConnectionPool(
+            1, len(PROCESSORS), **ps_conn.dict(), cursor_factory=DictCursor
+        )
+        connections = [pg_pool.getconn() for _ in PROCESSORS]
+        executor = ThreadPoolExecutor(max_workers=len(PROCESSORS))
+
+        def reopen(connection):
+            pg_pool.putconn(connection, close=True)
+            return pg_pool.getconn()
+
+    else:
+        pg_conn = psycopg2.connect(**ps_conn.dict(), cursor_factory=DictCursor)
+        connections = [pg_conn] * len(PROCESSORS)
+
+        def reopen(connection):
+            return psycopg2.connect(**ps_conn.dict(), cursor_factory=DictCursor)
+
+    processors = [
+        processor_class(es, connection, publisher, settings)
+        for processor_class, connection in zip(PROCESSORS, connections)
+    ]
+    try:
+        if settings.rebuild:
+            run_cycle(processors, executor, rebuild=True)
+        elif settings.cdc_enabled:
+            listener = ChangeListener(
+                ps_conn.dict(), settings.cdc_channel, settings.cdc_debounce
+            )
+            listen(processors, executor, settings, listener, reopen)
+        elif settings.daemon:
+            poll(processors, executor, settings, reopen)
+        else:
+            run_cycle(processors, executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+            pg_pool.closeall()
+        else:
+            # Соединение могло быть переоткрыто после сбоя
+            processors[0].extractor.connection.close()
+        lock.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+from prometheus_client import Counter, Gauge, start_http_server
+
+# Метрики проходов ETL в режиме демона
+
+CYCLE_DURATION = Gauge(
+    "etl_cycle_duration_seconds",
+    "Длительность последнего прохода ETL",
+    ["index"],
+)
+
+CYCLE_DOCUMENTS = Counter(
+    "etl_documents_total",
+    "Документы, загруженные в Elasticsearch",
+    ["index"],
+)
+
+LOADED_BYTES = Counter(
+    "etl_loaded_bytes_total",
+    "Объём документов, отправленных в Elasticsearch",
+    ["index"],
+)
+
+CYCLE_LAG = Gauge(
+    "etl_lag_seconds",
+    "Сколько ждало загрузки самое старое изменение последнего прохода",
+    ["index"],
+)
+
+POLL_INTERVAL = Gauge(
+    "etl_poll_interval_seconds",
+    "Текущий интервал опроса Postgres",
+)
+
+
+def record_cycle(index_name: str, duration: float, stats: dict) -> None:
+    """Записать метрики прохода ETL по индексу."""
+    CYCLE_DURATION.labels(index_name).set(duration)
+    CYCLE_DOCUMENTS.labels(index_name).inc(stats["loaded"])
+    LOADED_BYTES.labels(index_name).inc(stats["bytes"])
+    CYCLE_LAG.labels(index_name).set(stats["lag"])
+
+
+def start_metrics_server(port: int) -> None:
+    """HTTP-сервер метрик в формате Prometheus. Порт 0 - метрики не отдаются."""
+    if port:
+        start_http_server(port)
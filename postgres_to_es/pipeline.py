@@ -0,0 +1,136 @@
+import logging
+import queue
+import threading
+from typing import Any, Callable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Сигнал потокам следующей стадии, что данных больше не будет
+_STOP = object()
+
+
+class Pipeline:
+    """
+    Конвейер ETL: извлечение, преобразование и загрузка идут одновременно.
+    Извлечение выполняется в вызывающем потоке (соединение с Postgres не
+    передаётся между потоками), преобразование и загрузка - в пулах потоков.
+    Стадии связаны очередями ограниченного размера: если загрузка не успевает,
+    извлечение ждёт свободного места в очереди.
+    """
+
+    def __init__(
+        self,
+        transform: Callable[[Any], Any],
+        load: Callable[[Any], None],
+        queue_size: int = 4,
+        transform_workers: int = 1,
+        load_workers: int = 2,
+    ):
+        self.transform = transform
+        self.load = load
+        self.queue_size = queue_size
+        self.transform_workers = transform_workers
+        self.load_workers = load_workers
+        self._error: Optional[BaseException] = None
+        self._failed = threading.Event()
+
+    def run(self, batches: Iterable[Any]) -> None:
+        """Прогнать пачки данных через конвейер и дождаться окончания загрузки."""
+        self._error = None
+        self._failed.clear()
+        to_transform: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        to_load: queue.Queue = queue.Queue(maxsize=self.queue_size)
+
+        transformers = self._start(
+            self.transform_workers, self._transform_worker, to_transform, to_load
+        )
+        loaders = self._start(self.load_workers, self._load_worker, to_load, None)
+
+        try:
+            for batch in batches:
+                if not self._put(to_transform, batch):
+                    break
+        except BaseException as exc:
+            self._fail(exc)
+        finally:
+            self._stop(to_transform, transformers)
+            self._stop(to_load, loaders)
+
+        if self._error is not None:
+            raise self._error
+
+    def _start(
+        self,
+        count: int,
+        target: Callable,
+        source: queue.Queue,
+        sink: Optional[queue.Queue],
+    ) -> List[threading.Thread]:
+        threads = [
+            threading.Thread(target=target, args=(source, sink), daemon=True)
+            for _ in range(count)
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _stop(self, source: queue.Queue, threads: List[threading.Thread]) -> None:
+        """Дождаться, пока потоки стадии разберут очередь, и остановить их."""
+        for _ in threads:
+            self._put(source, _STOP, force=True)
+        for thread in threads:
+            thread.join()
+
+    def _put(self, target: queue.Queue, item: Any, force: bool = False) -> bool:
+        """
+        Положить элемент в очередь, ожидая свободного места.
+        Если конвейер упал, обычные элементы больше не кладутся.
+        """
+        while force or not self._failed.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if force and self._failed.is_set():
+                    # Потребители могли завершиться: освобождаем место.
+                    self._drain(target)
+        return False
+
+    @staticmethod
+    def _drain(source: queue.Queue) -> None:
+        try:
+            while True:
+                source.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _fail(self, exc: BaseException) -> None:
+        if self._error is None:
+            self._error = exc
+        self._failed.set()
+
+    def _transform_worker(self, source: queue.Queue, sink: queue.Queue) -> None:
+        while True:
+            batch = source.get()
+            if batch is _STOP:
+                return
+            if self._failed.is_set():
+                continue
+            try:
+                self._put(sink, self.transform(batch))
+            except Exception as exc:
+                logger.exception("Transform stage failed")
+                self._fail(exc)
+
+    def _load_worker(self, source: queue.Queue, sink: None) -> None:
+        while True:
+            batch = source.get()
+            if batch is _STOP:
+                return
+            if self._failed.is_set():
+                continue
+            try:
+                self.load(batch)
+            except Exception as exc:
+                logger.exception("Load stage failed")
+                self._fail(exc)
@@ -1,29 +1,56 @@
-from typing import Generator
+import csv
+import json
+import tempfile
+import uuid
+from itertools import islice
+from typing import Generator, Iterator
 
 import backoff
 import psycopg2
 from psycopg2.extensions import connection as _connection
-from queries import format_sql_for_ids
+from queries import format_sql_for_copy, format_sql_for_ids
 
 
 class PostgresExtractor:
-    """Класс для выгрузки данных из postgres."""
+    """
+    Класс для выгрузки данных из postgres.
+    Запросы выполняются на именованных (серверных) курсорах: строки
+    передаются с сервера порциями по itersize, а не целиком в память клиента.
+    """
 
-    def __init__(self, pg_conn: _connection):
+    def __init__(
+        self,
+        pg_conn: _connection,
+        batch_size: int = 100,
+        itersize: int = 2000,
+        server_side: bool = True,
+    ):
         self.connection = pg_conn
-        self.batch_size = 100
+        self.batch_size = batch_size
+        self.itersize = itersize
+        self.server_side = server_side
+
+    def _cursor(self):
+        if not self.server_side:
+            return self.connection.cursor()
+        cursor = self.connection.cursor(name=f"etl_{uuid.uuid4().hex}")
+        cursor.itersize = self.itersize
+        return cursor
+
+    def _batches(self, rows: Iterator) -> Generator:
+        """Разбиение потока строк на пачки по batch_size."""
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                return
+            yield batch
 
     @backoff.on_exception(backoff.expo, psycopg2.OperationalError)
     def execute_query_generator(self, query: str, *args) -> Generator:
         """Выполнение sql запроса, метод возвращает генератор."""
-        with self.connection.cursor() as cursor:
+        with self._cursor() as cursor:
             cursor.execute(query, args)
-
-            while True:
-                rows = cursor.fetchmany(size=self.batch_size)
-                if not rows:
-                    return
-                yield rows
+            yield from self._batches(iter(cursor))
 
     @backoff.on_exception(backoff.expo, psycopg2.OperationalError)
     def execute_query(self, query: str, *args) -> list:
@@ -33,7 +60,22 @@ class PostgresExtractor:
 
             return cursor.fetchall()
 
-    def extract_updated_ids(self, table: str, last_date: str) -> Generator:
-        """Получение генератора с id необновленных записей."""
+    @backoff.on_exception(backoff.expo, psycopg2.OperationalError)
+    def copy_query_generator(self, query: str) -> Generator:
+        """
+        Выгрузка результата запроса через COPY для полной загрузки.
+        Результат пишется во временный файл на диске и читается построчно,
+        поэтому память не зависит от объёма данных. Строки - словари.
+        """
+        with tempfile.TemporaryFile(mode="w+", newline="") as fp:
+            with self.connection.cursor() as cursor:
+                cursor.copy_expert(format_sql_for_copy(query), fp)
+            fp.seek(0)
+            rows = (json.loads(row[0]) for row in csv.reader(fp))
+            yield from self._batches(rows)
+
+    def extract_updated_ids(self, table: str, watermark: tuple, limit: int) -> list:
+        """Получение id и updated_at записей, изменённых после водяного знака."""
         query = format_sql_for_ids(table)
-        return self.execute_query_generator(query, (last_date,))
+        updated_at, last_id = watermark
+        return self.execute_query(query, updated_at, last_id, limit)
@@ -0,0 +1,32 @@
+import logging
+from typing import Iterable
+
+import backoff
+from redis import ConnectionError, Redis
+
+logger = logging.getLogger(__name__)
+
+
+class ChangePublisher:
+    """
+    Класс публикации идентификаторов изменённых документов в Redis Stream.
+    По этим событиям API инвалидирует свой кеш.
+    """
+
+    def __init__(self, connection: dict, stream: str, maxlen: int):
+        self.redis = Redis(host=connection["host"], port=connection["port"])
+        self.stream = stream
+        self.maxlen = maxlen
+
+    @backoff.on_exception(backoff.expo, ConnectionError)
+    def publish(self, index_name: str, ids: Iterable[str]) -> None:
+        """Публикация идентификаторов документов, изменённых в индексе."""
+        ids = ",".join(str(i) for i in ids)
+        if not ids:
+            return
+        self.redis.xadd(
+            self.stream,
+            {"index": index_name, "ids": ids},
+            maxlen=self.maxlen,
+            approximate=True,
+        )
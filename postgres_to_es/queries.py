@@ -2,9 +2,18 @@ from psycopg2 import sql
 
 
 def format_sql_for_ids(table_name: str):
-    """Запрос для получения id новых записей."""
+    """
+    Запрос для получения id новых записей после водяного знака (updated_at, id).
+    Сортировка по паре делает порядок однозначным, даже если у многих
+    записей одинаковый updated_at.
+    """
     query = sql.SQL(
-        "select id from {table} where updated_at >= %s order by updated_at;"
+        """
+        select id, updated_at from {table}
+        where (updated_at, id) > (%s, %s)
+        order by updated_at, id
+        limit %s;
+        """
     ).format(table=sql.Identifier(table_name))
     return query
 
@@ -13,10 +22,10 @@ def format_sql_for_related_filmwork(table_name: str, column_name: str):
     """Запрос для получения id кинопроизведений из связанных таблиц."""
     related_filmwork_ids = sql.SQL(
         """
-        select fw.id 
-        from film_work fw 
-        left join {table} on {table}.film_work_id = fw.id 
-        where {column} in %s order by fw.updated_at;
+        select distinct fw.id
+        from film_work fw
+        join {table} on {table}.film_work_id = fw.id
+        where {column} in %s;
         """
     ).format(
         table=sql.Identifier(table_name), column=sql.Identifier(table_name, column_name)
@@ -24,8 +33,11 @@ def format_sql_for_related_filmwork(table_name: str, column_name: str):
     return related_filmwork_ids
 
 
-def format_sql_for_all_filmworks():
-    """Запрос для получения данных кинопроизведений."""
+def format_sql_for_all_filmworks(by_ids: bool = True):
+    """
+    Запрос для получения данных кинопроизведений.
+    by_ids=False - все кинопроизведения, для полной загрузки.
+    """
     all_filmworks = """
     select 
         fw.id as _id,
@@ -49,56 +61,37 @@ def format_sql_for_all_filmworks():
         left join person p on p.id = pfw.person_id
         left join genre_film_work gfw on gfw.film_work_id = fw.id
         left join genre g on g.id = gfw.genre_id
-     where fw.id in %s
+     {where}
      group by fw.id
      order by fw.id;"""
-    return all_filmworks
-
-
-def format_sql_for_related_person(table_name: str, column_name: str):
-    """Запрос для получения id персон из связанных таблиц."""
-    related_person_ids = sql.SQL(
-        """
-        select distinct {column}
-        from film_work fw
-        left join {table} on {table}.film_work_id = fw.id 
-        where fw.id in %s;
-        """
-    ).format(
-        table=sql.Identifier(table_name), column=sql.Identifier(table_name, column_name)
-    )
-    return related_person_ids
+    where = "where fw.id in %s" if by_ids else ""
+    return all_filmworks.format(where=where)
 
 
-def format_sql_for_all_persons():
-    """Запрос для получения данных персон."""
+def format_sql_for_all_persons(by_ids: bool = True):
+    """
+    Запрос для получения данных персон. Фильмы персоны хранятся
+    в отдельном индексе связей (format_sql_for_all_person_films).
+    by_ids=False - все персоны, для полной загрузки.
+    """
     all_persons = """
-    select 
-            p.id _id,
-            p.id uuid,
-            p.full_name,
-            json_agg(
-                jsonb_build_object(
-                    'uuid', fw.id, 
-                    'title', fw.title, 
-                    'imdb_rating', fw.rating,
-                    'role', pfw.role
-                )
-            ) films
+    select
+        p.id _id,
+        p.id uuid,
+        p.full_name
     from person p
-        left join person_film_work pfw on pfw.person_id = p.id
-        left join film_work fw on fw.id = pfw.film_work_id 
-     where p.id in %s
-     group by 
-            p.id
-        ,   p.full_name
-     order by p.id;
+    {where}
+    order by p.id;
     """
-    return all_persons
+    where = "where p.id in %s" if by_ids else ""
+    return all_persons.format(where=where)
 
 
-def format_sql_for_all_genres():
-    """Запрос для получения списка жанров."""
+def format_sql_for_all_genres(by_ids: bool = True):
+    """
+    Запрос для получения списка жанров.
+    by_ids=False - все жанры, для полной загрузки.
+    """
     genres = """
     select 
         g.id as _id,
@@ -106,7 +99,108 @@ def format_sql_for_all_genres():
         g.name,
         g.description
     from genre g
-    where g.id in %s
+    {where}
     order by g.id;
     """
-    return genres
+    where = "where g.id in %s" if by_ids else ""
+    return genres.format(where=where)
+
+
+def format_sql_for_all_person_films(by_ids: bool = True):
+    """
+    Запрос для получения связей персон с кинопроизведениями по id кинопроизведений:
+    по документу на каждую роль персоны в фильме.
+    by_ids=False - все связи, для полной загрузки.
+    """
+    person_films = """
+    select
+        concat_ws(':', pfw.person_id, pfw.film_work_id, pfw.role) as _id,
+        concat_ws(':', pfw.person_id, pfw.film_work_id, pfw.role) as id,
+        pfw.person_id,
+        fw.id as film_id,
+        fw.title,
+        fw.rating as imdb_rating,
+        pfw.role
+    from film_work fw
+        join person_film_work pfw on pfw.film_work_id = fw.id
+    {where}
+    order by fw.id;
+    """
+    where = "where fw.id in %s" if by_ids else ""
+    return person_films.format(where=where)
+
+
+def format_sql_for_copy(query: str) -> str:
+    """Выгрузка результата запроса через COPY: по JSON-документу в строке CSV."""
+    query = query.strip().rstrip(";")
+    return f"copy (select row_to_json(q) from ({query}) q) to stdout with csv;"
+
+
+# Таблицы, изменения которых отслеживаются триггерами
+CHANGE_TRACKED_TABLES = (
+    "film_work",
+    "genre",
+    "person",
+    "genre_film_work",
+    "person_film_work",
+)
+
+
+# Таблицы из списка, на которых уже есть триггер etl_notify_change с нужным каналом
+SQL_INSTALLED_CHANGE_TRIGGERS = """
+    select c.relname
+    from pg_trigger t
+    join pg_class c on c.oid = t.tgrelid
+    where t.tgname = 'etl_notify_change'
+      and t.tgrelid in (select to_regclass(name)::oid from unnest(%s::text[]) name)
+      and t.tgargs = convert_to(%s, 'UTF8') || '\\x00'::bytea;
+"""
+
+
+def format_sql_for_change_triggers(channel: str, tables=CHANGE_TRACKED_TABLES):
+    """
+    Функция и триггеры на таблицах tables, которые сообщают об изменениях
+    через NOTIFY. В уведомлении только идентификаторы строки, время
+    изменения - now(), чтобы одинаковые уведомления в рамках транзакции
+    схлопывались.
+    """
+    function = sql.SQL(
+        """
+        create or replace function etl_notify_change() returns trigger as $$
+        declare
+            payload jsonb;
+            row_data jsonb;
+        begin
+            foreach row_data in array array[
+                case when tg_op <> 'INSERT' then to_jsonb(old) end,
+                case when tg_op <> 'DELETE' then to_jsonb(new) end
+            ] loop
+                continue when row_data is null;
+                payload := jsonb_strip_nulls(jsonb_build_object(
+                    'table', tg_table_name,
+                    'op', tg_op,
+                    'id', row_data->'id',
+                    'film_work_id', row_data->'film_work_id',
+                    'genre_id', row_data->'genre_id',
+                    'person_id', row_data->'person_id',
+                    'changed_at', extract(epoch from now())
+                ));
+                perform pg_notify(tg_argv[0], payload::text);
+            end loop;
+            return null;
+        end;
+        $$ language plpgsql;
+        """
+    )
+    triggers = [
+        sql.SQL(
+            """
+            drop trigger if exists etl_notify_change on {table};
+            create trigger etl_notify_change
+                after insert or update or delete on {table}
+                for each row execute procedure etl_notify_change({channel});
+            """
+        ).format(table=sql.Identifier(table), channel=sql.Literal(channel))
+        for table in tables
+    ]
+    return sql.Composed([function, *triggers])
@@ -1,5 +1,6 @@
 import abc
 import json
+import os
 from pathlib import Path
 from typing import Any, Optional
 
@@ -17,18 +18,36 @@ class BaseStorage:
 
 
 class JsonFileStorage(BaseStorage):
+    """
+    Хранение состояния в json-файле.
+    Файл читается один раз, дальше состояние берётся из памяти.
+    Запись атомарная: во временный файл рядом и переименование поверх старого,
+    поэтому при сбое во время записи остаётся предыдущее состояние.
+    """
+
     def __init__(self, file_path: Optional[str] = None):
         self.file_path = file_path or "state/state.json"
+        self._state: Optional[dict] = None
 
     def save_state(self, state: dict) -> None:
         """Сохранить состояние в постоянное хранилище"""
         data = self.retrieve_state()
         data.update(state)
-        with open(self.file_path, "w") as fp:
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, "w") as fp:
             json.dump(data, fp, ensure_ascii=False)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, self.file_path)
+        self._state = data
 
     def retrieve_state(self) -> dict:
         """Загрузить состояние локально из постоянного хранилища"""
+        if self._state is None:
+            self._state = self._read_state()
+        return dict(self._state)
+
+    def _read_state(self) -> dict:
         try:
             file = Path(self.file_path)
             file.parent.mkdir(parents=True, exist_ok=True)
@@ -53,6 +72,10 @@ class State:
         """Установить состояние для определённого ключа"""
         self.storage.save_state({key: value})
 
+    def set_states(self, values: dict) -> None:
+        """Установить состояние для нескольких ключей одной записью"""
+        self.storage.save_state(values)
+
     def get_state(self, key: str) -> Any:
         """Получить состояние по определённому ключу"""
         return self.storage.retrieve_state().get(key)
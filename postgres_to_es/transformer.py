@@ -7,3 +7,31 @@ def transform_data(data: list) -> list:
     """Подготовка данных для записи в ES после получения из БД, если не требуется каких-либо манипуляций данных."""
     transformed_data = [dict(d) for d in data]
     return transformed_data
+
+
+# Со скольких первых слов текста строятся варианты подсказки
+SUGGEST_MAX_WORDS = 10
+
+
+def suggest_inputs(text: str) -> list:
+    """
+    Варианты ввода completion-подсказки: текст целиком и его окончания,
+    начиная с каждого слова, чтобы подсказка находилась по началу любого слова.
+    """
+    words = text.split()
+    return [" ".join(words[i:]) for i in range(min(len(words), SUGGEST_MAX_WORDS))]
+
+
+def add_suggest(data: list, field: str, weight_field: str = None) -> list:
+    """
+    Добавление в документы поля suggest для подсказок при поиске по полю field.
+    Подсказки с большим значением weight_field (например, рейтингом) идут первыми.
+    """
+    for document in data:
+        inputs = suggest_inputs(document.get(field) or "")
+        if not inputs:
+            continue
+        document["suggest"] = {"input": inputs}
+        if weight_field:
+            document["suggest"]["weight"] = int((document.get(weight_field) or 0) * 10)
+    return data
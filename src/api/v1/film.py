@@ -1,10 +1,14 @@
 from http import HTTPStatus
-from typing import Optional
+from typing import List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 
-from models.constants import FILM_NOT_FOUND
-from models.film import ResponseFilm, ResponseFilmDetail
+from core.config import CACHE_RESPONSE_TTL, CACHE_SUGGEST_TTL
+from db.redis import cached_response
+from models.batch import BatchRequest
+from models.constants import (FILM_NOT_FOUND, MAX_PAGE_SIZE,
+                              MAX_SUGGEST_QUERY_LENGTH, MAX_SUGGEST_SIZE)
+from models.film import FilmSuggestion, ResponseFilm, ResponseFilmDetail
 from models.page import Page
 from services.film import FilmService, get_film_service
 
@@ -12,6 +16,7 @@ router = APIRouter()
 
 
 @router.get("/{film_id}", response_model=ResponseFilmDetail)
+@cached_response(CACHE_RESPONSE_TTL)
 async def film_details(
     film_id: str, film_service: FilmService = Depends(get_film_service)
 ) -> ResponseFilmDetail:
@@ -31,14 +36,36 @@ async def film_details(
     )
 
 
+@router.post("/batch", response_model=List[ResponseFilmDetail])
+async def film_batch(
+    request: BatchRequest, film_service: FilmService = Depends(get_film_service)
+) -> List[ResponseFilmDetail]:
+    films = await film_service.get_many(request.ids)
+    return [
+        ResponseFilmDetail(
+            uuid=film.id,
+            title=film.title,
+            imdb_rating=film.imdb_rating,
+            description=film.description,
+            genre=film.genres,
+            actors=film.actors,
+            writers=film.writers,
+            directors=film.directors,
+        )
+        for film in films
+    ]
+
+
 @router.get(path="/search/", response_model=Page[ResponseFilm])
+@cached_response(CACHE_RESPONSE_TTL, normalize=("query",))
 async def film_search(
     query: str,
     page_number: int = Query(1, alias="page[number]", ge=1),
-    page_size: int = Query(50, alias="page[size]", ge=1),
+    page_size: int = Query(50, alias="page[size]", ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, alias="page[cursor]"),
     film_service: FilmService = Depends(get_film_service),
 ) -> Page[ResponseFilm]:
-    page = await film_service.search(query, page_number, page_size)
+    page = await film_service.search(query, page_number, page_size, cursor)
     page.items = [
         ResponseFilm(uuid=film.id, title=film.title, imdb_rating=film.imdb_rating)
         for film in page.items
@@ -47,15 +74,29 @@ async def film_search(
     return page
 
 
+@router.get(path="/suggest/", response_model=List[FilmSuggestion])
+@cached_response(CACHE_SUGGEST_TTL, normalize=("query",))
+async def film_suggest(
+    query: str = Query(..., min_length=1, max_length=MAX_SUGGEST_QUERY_LENGTH),
+    size: int = Query(10, ge=1, le=MAX_SUGGEST_SIZE),
+    film_service: FilmService = Depends(get_film_service),
+) -> List[FilmSuggestion]:
+    return await film_service.suggest(query, size)
+
+
 @router.get("/")
+@cached_response(CACHE_RESPONSE_TTL)
 async def film_list(
     sort: Optional[str] = "-imdb_rating",
-    page_size: int = Query(50, alias="page[size]", ge=1),
+    page_size: int = Query(50, alias="page[size]", ge=1, le=MAX_PAGE_SIZE),
     page_number: int = Query(1, alias="page[number]", ge=1),
+    cursor: Optional[str] = Query(None, alias="page[cursor]"),
     filter_genre: str = Query(None, alias="filter[genre]"),
     film_service: FilmService = Depends(get_film_service),
 ) -> Page[ResponseFilm]:
-    page = await film_service.get_list(sort, page_size, page_number, filter_genre)
+    page = await film_service.get_list(
+        sort, page_size, page_number, filter_genre, cursor
+    )
     page.items = [
         ResponseFilm(uuid=film.id, title=film.title, imdb_rating=film.imdb_rating)
         for film in page.items
@@ -1,8 +1,10 @@
 from http import HTTPStatus
+from typing import List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 
-from models.constants import GENRE_NOT_FOUND
+from models.batch import BatchRequest
+from models.constants import GENRE_NOT_FOUND, MAX_PAGE_SIZE
 from models.genre import ResponseGenre
 from models.page import Page
 from services.genre import GenreService, get_genre_service
@@ -20,13 +22,22 @@ async def genre_details(
     return ResponseGenre(uuid=genre.id, name=genre.name)
 
 
+@router.post("/batch", response_model=List[ResponseGenre])
+async def genre_batch(
+    request: BatchRequest, genre_service: GenreService = Depends(get_genre_service)
+) -> List[ResponseGenre]:
+    genres = await genre_service.get_many(request.ids)
+    return [ResponseGenre(uuid=genre.id, name=genre.name) for genre in genres]
+
+
 @router.get("/")
 async def genre_list(
-    page_size: int = Query(50, alias="page[size]", ge=1),
+    page_size: int = Query(50, alias="page[size]", ge=1, le=MAX_PAGE_SIZE),
     page_number: int = Query(1, alias="page[number]", ge=1),
+    cursor: Optional[str] = Query(None, alias="page[cursor]"),
     genre_service: GenreService = Depends(get_genre_service),
 ) -> Page[ResponseGenre]:
-    genres = await genre_service.get_list(page_size, page_number)
+    genres = await genre_service.get_list(page_size, page_number, cursor)
     if not genres.items:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=GENRE_NOT_FOUND)
     genres.items = [
@@ -1,17 +1,23 @@
 from http import HTTPStatus
-from typing import Any, Dict
+from typing import List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 
-from models.constants import PERSON_NOT_FOUND
+from core.config import CACHE_RESPONSE_TTL, CACHE_SUGGEST_TTL
+from db.redis import cached_response
+from models.batch import BatchRequest
+from models.constants import (MAX_PAGE_SIZE, MAX_SUGGEST_QUERY_LENGTH,
+                              MAX_SUGGEST_SIZE, PERSON_NOT_FOUND)
+from models.film import FilmPerson
 from models.page import Page
-from models.person import ResponsePerson, ResponsePersonFilms
+from models.person import PersonSuggestion, ResponsePerson
 from services.person import PersonService, get_person_service
 
 router = APIRouter()
 
 
 @router.get("/{person_id}", response_model=ResponsePerson)
+@cached_response(CACHE_RESPONSE_TTL)
 async def person_details(
     person_id: str, person_service: PersonService = Depends(get_person_service)
 ) -> ResponsePerson:
@@ -22,28 +28,67 @@ async def person_details(
     return ResponsePerson(**person.dict())
 
 
-@router.get("/{person_id}/film", response_model=ResponsePersonFilms)
+@router.get("/{person_id}/film", response_model=Page[FilmPerson])
+@cached_response(CACHE_RESPONSE_TTL, tags=("person_id",))
 async def person_film_details(
-    person_id: str, person_service: PersonService = Depends(get_person_service)
-) -> Dict[str, Any]:
+    person_id: str,
+    sort: Optional[str] = "-imdb_rating",
+    page_size: int = Query(50, alias="page[size]", ge=1, le=MAX_PAGE_SIZE),
+    page_number: int = Query(1, alias="page[number]", ge=1),
+    cursor: Optional[str] = Query(None, alias="page[cursor]"),
+    role: Optional[str] = Query(None, alias="filter[role]"),
+    person_service: PersonService = Depends(get_person_service),
+) -> Page[FilmPerson]:
     person = await person_service.get_by_id(person_id)
     if not person:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=PERSON_NOT_FOUND)
 
-    return person.dict()
+    page = await person_service.get_films(
+        person_id, sort, page_size, page_number, role, cursor
+    )
+    page.items = [
+        FilmPerson(
+            uuid=film.film_id,
+            title=film.title,
+            role=film.role,
+            imdb_rating=film.imdb_rating,
+        )
+        for film in page.items
+    ]
+    return page
+
+
+@router.post("/batch", response_model=List[ResponsePerson])
+async def person_batch(
+    request: BatchRequest, person_service: PersonService = Depends(get_person_service)
+) -> List[ResponsePerson]:
+    persons = await person_service.get_many(request.ids)
+    return [ResponsePerson(**person.dict()) for person in persons]
 
 
 @router.get(path="/search/", response_model=Page[ResponsePerson])
+@cached_response(CACHE_RESPONSE_TTL, normalize=("query",))
 async def film_search(
     query: str,
     page_number: int = Query(1, alias="page[number]", ge=1),
-    page_size: int = Query(50, alias="page[size]", ge=1),
+    page_size: int = Query(50, alias="page[size]", ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, alias="page[cursor]"),
     person_service: PersonService = Depends(get_person_service),
 ) -> Page[ResponsePerson]:
-    page = await person_service.search(query, page_size, page_number)
+    page = await person_service.search(query, page_size, page_number, cursor)
     page.items = [
-        ResponsePerson(uuid=person.uuid, full_name=person.full_name, films=person.films)
+        ResponsePerson(uuid=person.uuid, full_name=person.full_name)
         for person in page.items
     ]
 
     return page
+
+
+@router.get(path="/suggest/", response_model=List[PersonSuggestion])
+@cached_response(CACHE_SUGGEST_TTL, normalize=("query",))
+async def person_suggest(
+    query: str = Query(..., min_length=1, max_length=MAX_SUGGEST_QUERY_LENGTH),
+    size: int = Query(10, ge=1, le=MAX_SUGGEST_SIZE),
+    person_service: PersonService = Depends(get_person_service),
+) -> List[PersonSuggestion]:
+    return await person_service.suggest(query, size)
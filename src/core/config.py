@@ -16,6 +16,77 @@ REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 # Настройки Elasticsearch
 ELASTIC_HOST = os.getenv("ELASTIC_HOST", "127.0.0.1")
 ELASTIC_PORT = int(os.getenv("ELASTIC_PORT", 9200))
+# Узлы кластера через запятую, по умолчанию один узел ELASTIC_HOST:ELASTIC_PORT
+ELASTIC_HOSTS = os.getenv("ELASTIC_HOSTS", f"{ELASTIC_HOST}:{ELASTIC_PORT}").split(",")
+# Максимум соединений к одному узлу и keep-alive простаивающих соединений
+ELASTIC_MAXSIZE = int(os.getenv("ELASTIC_MAXSIZE", 25))
+ELASTIC_KEEPALIVE_TIMEOUT = float(os.getenv("ELASTIC_KEEPALIVE_TIMEOUT", 30))
+# Таймаут запроса в секундах и повторы при ошибках и таймаутах
+ELASTIC_TIMEOUT = float(os.getenv("ELASTIC_TIMEOUT", 5))
+ELASTIC_MAX_RETRIES = int(os.getenv("ELASTIC_MAX_RETRIES", 2))
+ELASTIC_RETRY_ON_TIMEOUT = (
+    os.getenv("ELASTIC_RETRY_ON_TIMEOUT", "true").lower() == "true"
+)
+# Обнаружение узлов кластера: при старте, при ошибке соединения и периодически
+ELASTIC_SNIFF = os.getenv("ELASTIC_SNIFF", "false").lower() == "true"
+ELASTIC_SNIFFER_TIMEOUT = int(os.getenv("ELASTIC_SNIFFER_TIMEOUT", 60))
+# Сжатие тел запросов gzip
+ELASTIC_HTTP_COMPRESS = os.getenv("ELASTIC_HTTP_COMPRESS", "true").lower() == "true"
+
+# Локальный (in-memory) кеш воркера перед Redis
+CACHE_LOCAL_ENABLED = os.getenv("CACHE_LOCAL_ENABLED", "false").lower() == "true"
+CACHE_LOCAL_MAX_ITEMS = int(os.getenv("CACHE_LOCAL_MAX_ITEMS", 1000))
+CACHE_LOCAL_MAX_BYTES = int(os.getenv("CACHE_LOCAL_MAX_BYTES", 64 * 1024 * 1024))
+CACHE_LOCAL_TTL = int(os.getenv("CACHE_LOCAL_TTL", 60))
+
+# Распределённая блокировка на загрузку ключа при промахе кеша:
+# между воркерами и подами в ES за ключом ходит только один из них
+CACHE_LOCK_ENABLED = os.getenv("CACHE_LOCK_ENABLED", "false").lower() == "true"
+CACHE_LOCK_TIMEOUT = int(os.getenv("CACHE_LOCK_TIMEOUT", 10))
+CACHE_LOCK_POLL_INTERVAL = float(os.getenv("CACHE_LOCK_POLL_INTERVAL", 0.05))
+
+# Формат значений в Redis: сериализатор (orjson, msgpack), сжатие
+# (none, zlib, zstd, lz4) и размер значения в байтах, начиная с которого оно сжимается
+CACHE_SERIALIZER = os.getenv("CACHE_SERIALIZER", "orjson")
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "zstd")
+CACHE_COMPRESSION_MIN_SIZE = int(os.getenv("CACHE_COMPRESSION_MIN_SIZE", 512))
+
+# Время жизни готовых тел ответов ручек в кеше
+CACHE_RESPONSE_TTL = int(os.getenv("CACHE_RESPONSE_TTL", 5 * 60))
+
+# Время жизни ответов ручек подсказок (suggest): короткое, т.к. запросов много
+# и они почти не повторяются дольше нескольких секунд набора текста
+CACHE_SUGGEST_TTL = int(os.getenv("CACHE_SUGGEST_TTL", 30))
+
+# Инвалидация кеша по событиям об изменённых документах из ETL
+CACHE_INVALIDATION_ENABLED = (
+    os.getenv("CACHE_INVALIDATION_ENABLED", "true").lower() == "true"
+)
+CACHE_INVALIDATION_STREAM = os.getenv("CACHE_INVALIDATION_STREAM", "etl:changes")
+CACHE_INVALIDATION_BLOCK_MS = int(os.getenv("CACHE_INVALIDATION_BLOCK_MS", 5000))
+# Поток с ключами, удалёнными при инвалидации: по нему воркеры чистят
+# свой локальный кеш
+CACHE_EVICTION_STREAM = os.getenv("CACHE_EVICTION_STREAM", "cache:evicted")
+CACHE_EVICTION_STREAM_MAXLEN = int(os.getenv("CACHE_EVICTION_STREAM_MAXLEN", 10000))
+
+# Небольшие справочники (жанры) целиком в памяти воркера
+SNAPSHOT_ENABLED = os.getenv("SNAPSHOT_ENABLED", "true").lower() == "true"
+# Интервал обновления снимка в секундах; по событиям из ETL он обновляется сразу
+SNAPSHOT_REFRESH_INTERVAL = int(os.getenv("SNAPSHOT_REFRESH_INTERVAL", 5 * 60))
+# Справочник больше этого размера в память не загружается
+SNAPSHOT_MAX_ITEMS = int(os.getenv("SNAPSHOT_MAX_ITEMS", 1000))
+
+# Прогрев кеша при старте приложения
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+# Сколько первых страниц списка фильмов прогревать (для каждого жанра тоже)
+WARMUP_FILM_PAGES = int(os.getenv("WARMUP_FILM_PAGES", 3))
+# Сколько самых популярных фильмов по imdb_rating прогревать
+WARMUP_TOP_FILMS = int(os.getenv("WARMUP_TOP_FILMS", 100))
+# Прогрев при старте выполняет один воркер, остальные в течение этого
+# времени (в секундах) его пропускают
+WARMUP_LOCK_TTL = int(os.getenv("WARMUP_LOCK_TTL", 10 * 60))
+# Сколько запросов прогрева выполняется одновременно
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", 5))
 
 # Корень проекта
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
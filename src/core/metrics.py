@@ -0,0 +1,134 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+# Метрики приложения в формате Prometheus.
+# При запуске под gunicorn с несколькими воркерами нужно задать переменную
+# окружения PROMETHEUS_MULTIPROC_DIR, тогда /metrics собирает данные всех воркеров.
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки запроса",
+    ["method", "route", "status"],
+)
+
+STAGE_LATENCY = Histogram(
+    "stage_duration_seconds",
+    "Время этапа обработки запроса",
+    ["stage", "name"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+ES_REQUEST_LATENCY = Histogram(
+    "elasticsearch_request_duration_seconds",
+    "Время запроса к Elasticsearch на стороне клиента",
+    ["operation", "index"],
+)
+
+ES_TOOK = Histogram(
+    "elasticsearch_took_seconds",
+    "Время выполнения запроса, которое сообщает Elasticsearch (took)",
+    ["operation", "index"],
+)
+
+# Уровни и результаты: ("local", "hit"), ("local", "miss"), ("redis", "hit"),
+# ("redis", "miss"), ("flight", "joined") - запрос дождался уже идущей загрузки,
+# ("redis", "refresh") - запущено фоновое обновление устаревшего значения,
+# ("response", "hit"), ("response", "miss") - кеш готовых ответов ручек,
+# ("invalidation", "evicted") - ключи, удалённые по событиям из ETL.
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Обращения к кешу по уровням и результатам",
+    ["tier", "result", "model", "function"],
+)
+
+ES_POOL_CONNECTIONS = Gauge(
+    "elasticsearch_pool_connections",
+    "Соединения пула Elasticsearch: занятые, ожидающие, лимит",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+
+WARMUP_DURATION = Gauge(
+    "cache_warmup_duration_seconds",
+    "Длительность последнего прогрева кеша",
+    multiprocess_mode="max",
+)
+
+
+@contextmanager
+def timer(stage: str, name: str = ""):
+    """Замер времени этапа обработки запроса."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage, name).observe(time.perf_counter() - started)
+
+
+def set_pool_stats(stats: dict) -> None:
+    """Обновить метрики пула соединений Elasticsearch."""
+    for state in ("in_use", "waiting", "limit"):
+        ES_POOL_CONNECTIONS.labels(state).set(stats.get(state, 0))
+
+
+def render_metrics() -> tuple:
+    """Метрики в текстовом формате Prometheus и их content type."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class LatencyMiddleware:
+    """
+    ASGI-middleware: время обработки запросов по шаблонам путей.
+    Метка route - шаблон пути (/api/v1/film/{film_id}), а не сам путь,
+    чтобы число временных рядов не зависело от числа объектов.
+    collect - функция, которая вызывается после каждого запроса
+    для обновления метрик состояния (например, пула соединений).
+    """
+
+    def __init__(self, app, collect: Optional[Callable[[], None]] = None):
+        self.app = app
+        self.collect = collect
+        self._route_paths = None
+
+    def _route(self, scope: dict) -> str:
+        if self._route_paths is None:
+            self._route_paths = {
+                route.endpoint: route.path
+                for route in scope["app"].routes
+                if hasattr(route, "endpoint")
+            }
+        return self._route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def _send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            REQUEST_LATENCY.labels(
+                scope["method"], self._route(scope), status_code
+            ).observe(time.perf_counter() - started)
+            if self.collect is not None:
+                self.collect()
@@ -0,0 +1,168 @@
+import struct
+import zlib
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+import orjson
+
+# Формат значения в кеше:
+# версия (1 байт) | сериализатор (1 байт) | сжатие (1 байт) |
+# stale_at и delta (2 x double) | полезная нагрузка.
+# Значения с другой версией формата читаются как промах и перезаписываются,
+# поэтому формат можно менять без очистки Redis.
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<BBBdd")
+
+# Коды сериализаторов и алгоритмов сжатия хранятся в каждом значении:
+# значение читается, даже если настройки с тех пор поменялись.
+RAW = 0
+ORJSON = 1
+MSGPACK = 2
+
+NO_COMPRESSION = 0
+ZLIB = 1
+ZSTD = 2
+LZ4 = 3
+
+SERIALIZERS = {"orjson": ORJSON, "msgpack": MSGPACK}
+COMPRESSIONS = {"none": NO_COMPRESSION, "zlib": ZLIB, "zstd": ZSTD, "lz4": LZ4}
+
+Codec = Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]
+
+
+class Packed(NamedTuple):
+    """Упакованное значение и размер сериализованных данных до сжатия."""
+
+    raw: bytes
+    size: int
+
+
+class Unpacked(NamedTuple):
+    """
+    Разобранное значение: метаданные XFetch, данные и размер
+    сериализованных данных после распаковки.
+    """
+
+    stale_at: float
+    delta: float
+    data: Any
+    size: int
+
+
+def _orjson() -> Codec:
+    return orjson.dumps, orjson.loads
+
+
+def _msgpack() -> Codec:
+    import msgpack
+
+    return (
+        lambda data: msgpack.packb(data, use_bin_type=True),
+        lambda payload: msgpack.unpackb(payload, raw=False),
+    )
+
+
+def _zlib() -> Codec:
+    return lambda payload: zlib.compress(payload, 1), zlib.decompress
+
+
+def _zstd() -> Codec:
+    import zstandard
+
+    compressor = zstandard.ZstdCompressor(level=3)
+    decompressor = zstandard.ZstdDecompressor()
+    return compressor.compress, decompressor.decompress
+
+
+def _lz4() -> Codec:
+    import lz4.frame
+
+    return lz4.frame.compress, lz4.frame.decompress
+
+
+_SERIALIZER_FACTORIES: Dict[int, Callable[[], Codec]] = {
+    ORJSON: _orjson,
+    MSGPACK: _msgpack,
+}
+_COMPRESSION_FACTORIES: Dict[int, Callable[[], Codec]] = {
+    ZLIB: _zlib,
+    ZSTD: _zstd,
+    LZ4: _lz4,
+}
+
+
+class CacheCodec:
+    """
+    Упаковка значений кеша в компактный бинарный формат: заголовок
+    с версией формата и метаданными XFetch, сериализованные данные,
+    сжатые, если они больше min_size байт.
+    Библиотеки msgpack, zstandard и lz4 нужны, только если выбраны в настройках
+    или встретились в уже записанных значениях.
+    """
+
+    def __init__(self, serializer: str, compression: str, min_size: int):
+        if serializer not in SERIALIZERS:
+            raise ValueError(f"Unknown cache serializer: {serializer}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown cache compression: {compression}")
+        self.serializer = SERIALIZERS[serializer]
+        self.compression = COMPRESSIONS[compression]
+        self.min_size = min_size
+        self._serializers: Dict[int, Codec] = {}
+        self._compressions: Dict[int, Codec] = {}
+        # Выбранные библиотеки загружаются сразу: ошибка настройки видна при старте.
+        self._serializer(self.serializer)
+        if self.compression != NO_COMPRESSION:
+            self._compressor(self.compression)
+
+    def _serializer(self, code: int) -> Codec:
+        if code not in self._serializers:
+            self._serializers[code] = _SERIALIZER_FACTORIES[code]()
+        return self._serializers[code]
+
+    def _compressor(self, code: int) -> Codec:
+        if code not in self._compressions:
+            self._compressions[code] = _COMPRESSION_FACTORIES[code]()
+        return self._compressions[code]
+
+    def dumps(self, data: Any, stale_at: float = 0.0, delta: float = 0.0) -> Packed:
+        """Упаковать данные (dict, list и т.п.) выбранным сериализатором."""
+        payload = self._serializer(self.serializer)[0](data)
+        return self._pack(self.serializer, payload, stale_at, delta)
+
+    def dumps_raw(
+        self, payload: bytes, stale_at: float = 0.0, delta: float = 0.0
+    ) -> Packed:
+        """Упаковать уже готовые байты, например, тело ответа."""
+        return self._pack(RAW, payload, stale_at, delta)
+
+    def _pack(
+        self, serializer: int, payload: bytes, stale_at: float, delta: float
+    ) -> Packed:
+        size = len(payload)
+        compression = NO_COMPRESSION
+        if self.compression != NO_COMPRESSION and size >= self.min_size:
+            compression = self.compression
+            payload = self._compressor(compression)[0](payload)
+        header = _HEADER.pack(FORMAT_VERSION, serializer, compression, stale_at, delta)
+        return Packed(header + payload, size)
+
+    def loads(self, raw: bytes) -> Optional[Unpacked]:
+        """
+        Разобрать значение на stale_at, delta и данные (для dumps_raw - байты).
+        None, если значение записано в другом формате и его нужно перезаписать.
+        """
+        if len(raw) < _HEADER.size or raw[0] != FORMAT_VERSION:
+            return None
+        _, serializer, compression, stale_at, delta = _HEADER.unpack_from(raw)
+        payload = raw[_HEADER.size :]
+        try:
+            if compression != NO_COMPRESSION:
+                payload = self._compressor(compression)[1](payload)
+            size = len(payload)
+            if serializer != RAW:
+                payload = self._serializer(serializer)[1](payload)
+        except (KeyError, ImportError):
+            # Значение записано кодеком, который этому воркеру неизвестен
+            # или недоступен (нет библиотеки).
+            return None
+        return Unpacked(stale_at, delta, payload, size)
@@ -1,10 +1,115 @@
-from typing import Optional
+import asyncio
+import time
+from typing import Optional, Tuple
 
-from elasticsearch import AsyncElasticsearch
+import aiohttp
+from elasticsearch import AIOHttpConnection, AsyncElasticsearch, AsyncTransport
+from elasticsearch._async.http_aiohttp import ESClientResponse
+
+from core import config
+from core.metrics import ES_REQUEST_LATENCY, ES_TOOK
 
 es: Optional[AsyncElasticsearch] = None
 
 
+class PooledAIOHttpConnection(AIOHttpConnection):
+    """
+    Соединение с узлом ES через aiohttp с настраиваемым keep-alive.
+    Даёт доступ к состоянию пула соединений узла.
+    """
+
+    def __init__(self, *args, keepalive_timeout: float = 15, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._keepalive_timeout = keepalive_timeout
+
+    async def _create_aiohttp_session(self):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        self.session = aiohttp.ClientSession(
+            headers=self.headers,
+            auto_decompress=True,
+            loop=self.loop,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            response_class=ESClientResponse,
+            connector=aiohttp.TCPConnector(
+                limit=self._limit,
+                keepalive_timeout=self._keepalive_timeout,
+                use_dns_cache=True,
+                ssl=self._ssl_context,
+            ),
+        )
+
+    @property
+    def pool_stats(self) -> dict:
+        """Занятые соединения и запросы, ожидающие свободного соединения."""
+        connector = self.session.connector if self.session else None
+        if connector is None:
+            return {"in_use": 0, "waiting": 0}
+        waiters = getattr(connector, "_waiters", {})
+        if isinstance(waiters, dict):
+            waiting = sum(len(w) for w in waiters.values())
+        else:
+            waiting = len(waiters)
+        return {"in_use": len(getattr(connector, "_acquired", ())), "waiting": waiting}
+
+
+class InstrumentedTransport(AsyncTransport):
+    """Транспорт, который замеряет время запросов и took, сообщаемый ES."""
+
+    @staticmethod
+    def _labels(url: str) -> Tuple[str, str]:
+        """Операция и индекс по пути запроса: /movies/_search -> (search, movies)."""
+        parts = [p for p in url.split("?")[0].split("/") if p]
+        index = parts[0] if parts and not parts[0].startswith("_") else ""
+        operation = next((p[1:] for p in parts if p.startswith("_")), "")
+        return operation or "other", index
+
+    async def perform_request(self, method, url, headers=None, params=None, body=None):
+        started = time.perf_counter()
+        try:
+            return_value = await super().perform_request(
+                method, url, headers=headers, params=params, body=body
+            )
+        finally:
+            labels = self._labels(url)
+            ES_REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - started)
+        if isinstance(return_value, dict) and "took" in return_value:
+            ES_TOOK.labels(*labels).observe(return_value["took"] / 1000)
+        return return_value
+
+
+def create_elastic() -> AsyncElasticsearch:
+    """Клиент ES с настройками пула соединений, таймаутов и повторов из конфига."""
+    sniffer_timeout = config.ELASTIC_SNIFFER_TIMEOUT if config.ELASTIC_SNIFF else None
+    return AsyncElasticsearch(
+        hosts=config.ELASTIC_HOSTS,
+        transport_class=InstrumentedTransport,
+        connection_class=PooledAIOHttpConnection,
+        maxsize=config.ELASTIC_MAXSIZE,
+        keepalive_timeout=config.ELASTIC_KEEPALIVE_TIMEOUT,
+        timeout=config.ELASTIC_TIMEOUT,
+        max_retries=config.ELASTIC_MAX_RETRIES,
+        retry_on_timeout=config.ELASTIC_RETRY_ON_TIMEOUT,
+        sniff_on_start=config.ELASTIC_SNIFF,
+        sniff_on_connection_fail=config.ELASTIC_SNIFF,
+        sniffer_timeout=sniffer_timeout,
+        http_compress=config.ELASTIC_HTTP_COMPRESS,
+    )
+
+
+def get_pool_stats() -> dict:
+    """Суммарное состояние пулов соединений по всем узлам ES."""
+    stats = {"nodes": 0, "limit": 0, "in_use": 0, "waiting": 0}
+    if es is None:
+        return stats
+    for connection in es.transport.connection_pool.connections:
+        stats["nodes"] += 1
+        stats["limit"] += connection._limit
+        for name, value in connection.pool_stats.items():
+            stats[name] += value
+    return stats
+
+
 # Функция понадобится при внедрении зависимостей
 async def get_elastic() -> AsyncElasticsearch:
     return es
@@ -0,0 +1,59 @@
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+
+class LRUCache:
+    """
+    Локальный (в пределах воркера) LRU-кеш.
+    Ограничен по количеству записей и суммарному размеру в байтах,
+    у каждой записи есть собственное время жизни.
+    """
+
+    def __init__(self, max_items: int, max_bytes: int, ttl: int):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._data: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Получить значение по ключу, просроченные записи удаляются."""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, _, expire_at = item
+        if expire_at <= time.monotonic():
+            self.delete(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, size: int, ttl: Optional[int] = None) -> None:
+        """
+        Сохранить значение. Время жизни не превышает ttl самого кеша,
+        слишком большие значения не сохраняются.
+        """
+        if size > self.max_bytes:
+            return
+        ttl = min(ttl, self.ttl) if ttl else self.ttl
+        self.delete(key)
+        self._data[key] = (value, size, time.monotonic() + ttl)
+        self.size += size
+        while len(self._data) > self.max_items or self.size > self.max_bytes:
+            _, (_, evicted_size, _) = self._data.popitem(last=False)
+            self.size -= evicted_size
+
+    def delete(self, key: str) -> None:
+        """Удалить значение по ключу."""
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.size -= item[1]
+
+    def clear(self) -> None:
+        """Очистить кеш."""
+        self._data.clear()
+        self.size = 0
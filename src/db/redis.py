@@ -1,40 +1,572 @@
+import asyncio
+import hashlib
+import inspect
+import logging
+import math
+import random
+import time
+import unicodedata
+import uuid
 from functools import wraps
-from typing import Callable, Optional, Type
+from typing import (Any, Awaitable, Callable, Dict, Iterable, List, Optional,
+                    Set, Tuple, Type)
 
+import orjson
 from aioredis import Redis
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
 
+from core import config
+from core.metrics import CACHE_REQUESTS, timer
+from db.codec import CacheCodec
+from db.memory import LRUCache
 from models.base import BaseApiModel
 from models.page import Page
 
+logger = logging.getLogger(__name__)
+
 redis: Optional[Redis] = None
 
+# Формат значений в Redis: сериализация, сжатие и заголовок с метаданными.
+codec = CacheCodec(
+    config.CACHE_SERIALIZER, config.CACHE_COMPRESSION, config.CACHE_COMPRESSION_MIN_SIZE
+)
+
+# Локальный кеш воркера, стоит перед Redis. Создаётся при старте приложения,
+# если включён в настройках.
+local_cache: Optional[LRUCache] = None
+
+# Загрузки, которые выполняются прямо сейчас: ключ кеша -> задача.
+# Параллельные промахи по одному ключу ждут одну и ту же задачу.
+_in_flight: Dict[str, "asyncio.Future"] = {}
+
+# Фоновые обновления устаревших значений: ключ кеша -> задача.
+_refreshing: Dict[str, "asyncio.Future"] = {}
+
+# Обработчики событий ETL об изменениях в индексе: имя индекса -> функции.
+# Вызываются после инвалидации кеша, например, чтобы обновить снимок справочника.
+change_handlers: Dict[str, List[Callable[[], None]]] = {}
+
+# Добавляет ключ в тег и продлевает тег до ttl, но никогда не укорачивает:
+# иначе тег истечёт раньше долгоживущего ключа, и инвалидация его не найдёт.
+_ADD_TO_TAG_SCRIPT = """
+redis.call("sadd", KEYS[1], ARGV[1])
+if redis.call("ttl", KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call("expire", KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+# Удаляет значения из тегов и сами теги одним атомарным шагом и возвращает
+# удалённые ключи. Параллельная инвалидация тех же тегов в другом воркере
+# получит пустой список и не разошлёт ключи повторно.
+_INVALIDATE_SCRIPT = """
+local evicted = {}
+local seen = {}
+for _, tag in ipairs(KEYS) do
+    for _, key in ipairs(redis.call("smembers", tag)) do
+        if not seen[key] then
+            seen[key] = true
+            redis.call("del", key)
+            evicted[#evicted + 1] = key
+        end
+        redis.call("srem", tag, key)
+    end
+end
+return evicted
+"""
+
+# Снимает блокировку, только если она всё ещё принадлежит нам.
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
 
 async def get_redis() -> Redis:
     return redis
 
 
+def _count(
+    tier: str, result: str, model: str = "", function: str = "", amount: int = 1
+) -> None:
+    """Учесть обращение к кешу в метриках Prometheus."""
+    CACHE_REQUESTS.labels(tier, result, model, function).inc(amount)
+
+
+async def _acquire_lock(key: str) -> Optional[str]:
+    """Взять распределённую блокировку на загрузку ключа."""
+    token = uuid.uuid4().hex
+    acquired = await redis.set(
+        f"lock|{key}",
+        token,
+        expire=config.CACHE_LOCK_TIMEOUT,
+        exist=redis.SET_IF_NOT_EXIST,
+    )
+    return token if acquired else None
+
+
+async def _release_lock(key: str, token: str) -> None:
+    await redis.eval(_RELEASE_LOCK_SCRIPT, keys=[f"lock|{key}"], args=[token])
+
+
+async def _wait_for_value(key: str) -> Optional[bytes]:
+    """Дождаться, пока другой воркер положит значение в Redis."""
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + config.CACHE_LOCK_TIMEOUT
+    while loop.time() < deadline:
+        await asyncio.sleep(config.CACHE_LOCK_POLL_INTERVAL)
+        raw = await redis.get(key)
+        if raw:
+            return raw
+        if not await redis.exists(f"lock|{key}"):
+            return None
+    return None
+
+
+def _should_refresh(stale_at: float, delta: float, beta: float) -> bool:
+    """
+    Пора ли обновить значение: оно устарело либо выпало досрочное
+    вероятностное обновление (XFetch): now - delta * beta * ln(rand) >= stale_at.
+    """
+    now = time.time()
+    if now >= stale_at:
+        return True
+    if beta <= 0 or delta <= 0:
+        return False
+    return now - delta * beta * math.log(1.0 - random.random()) >= stale_at
+
+
+def _collect_ids(data: Any) -> Set[str]:
+    """Идентификаторы документов, из которых собрано закешированное значение."""
+    if isinstance(data, Page):
+        items = data.items
+    elif isinstance(data, list):
+        items = data
+    else:
+        items = [data]
+    ids = set()
+    for item in items:
+        if isinstance(item, dict):
+            doc_id = item.get("id") or item.get("uuid")
+        else:
+            doc_id = getattr(item, "id", None) or getattr(item, "uuid", None)
+        if doc_id:
+            ids.add(str(doc_id))
+    return ids
+
+
+def _argument_tags(arguments: Dict[str, Any], names: Tuple[str, ...]) -> Set[str]:
+    """Идентификаторы документов из аргументов вызова с именами names."""
+    return {str(arguments[name]) for name in names if arguments.get(name)}
+
+
+async def _set_with_tags(key: str, value: bytes, ttl: int, ids: Set[str]) -> None:
+    """
+    Сохранить значение и привязать ключ к тегам документов, из которых оно
+    собрано. По тегу ключ находится при инвалидации после обновления документа.
+    """
+    await _set_many_with_tags([(key, value, ids)], ttl)
+
+
+async def _set_many_with_tags(
+    entries: List[Tuple[str, bytes, Set[str]]], ttl: int
+) -> None:
+    """Сохранить несколько значений с тегами одним пайплайном."""
+    tr = redis.pipeline()
+    for key, value, ids in entries:
+        tr.set(key, value, expire=ttl)
+        for doc_id in ids:
+            tr.eval(_ADD_TO_TAG_SCRIPT, keys=[f"tag|{doc_id}"], args=[key, ttl])
+    await tr.execute()
+
+
+async def invalidate(ids: Iterable[str]) -> int:
+    """
+    Удалить из Redis все значения, в которые вошли документы с указанными
+    идентификаторами, и разослать удалённые ключи всем воркерам,
+    чтобы они почистили свой локальный кеш.
+    """
+    tags = [f"tag|{doc_id}" for doc_id in ids]
+    if not tags:
+        return 0
+    keys = await redis.eval(_INVALIDATE_SCRIPT, keys=tags)
+    if not keys:
+        return 0
+    await redis.xadd(
+        config.CACHE_EVICTION_STREAM,
+        {"keys": b",".join(keys)},
+        max_len=config.CACHE_EVICTION_STREAM_MAXLEN,
+        exact_len=False,
+    )
+    _count("invalidation", "evicted", amount=len(keys))
+    return len(keys)
+
+
+def _evict_locally(fields: Dict[bytes, bytes]) -> None:
+    """Удалить из локального кеша ключи из события об инвалидации."""
+    if local_cache is None:
+        return
+    for key in fields.get(b"keys", b"").decode().split(","):
+        if key:
+            local_cache.delete(key)
+
+
+async def _handle_change(event_id: bytes, fields: Dict[bytes, bytes]) -> None:
+    """Инвалидировать кеш по событию из ETL и вызвать обработчики индекса."""
+    ids = fields.get(b"ids", b"").decode().split(",")
+    evicted = await invalidate(i for i in ids if i)
+    logger.debug("Invalidated %s cache keys by event %s", evicted, event_id)
+    index = fields.get(b"index", b"").decode()
+    for handler in change_handlers.get(index, ()):
+        handler()
+
+
+async def listen_invalidations(conn: Redis) -> None:
+    """
+    Чтение событий об изменённых документах, которые публикует ETL,
+    и инвалидация зависящих от них значений кеша.
+    Каждый воркер читает оба потока целиком: ключи, удалённые из Redis
+    любым воркером, приходят в CACHE_EVICTION_STREAM и чистятся из
+    локального кеша.
+    XREAD блокирует соединение, поэтому потоки читаются через отдельное
+    соединение conn, а не через общий пул.
+    """
+    latest_ids = {
+        config.CACHE_INVALIDATION_STREAM: "$",
+        config.CACHE_EVICTION_STREAM: "$",
+    }
+    while True:
+        try:
+            events = await conn.xread(
+                list(latest_ids),
+                timeout=config.CACHE_INVALIDATION_BLOCK_MS,
+                latest_ids=list(latest_ids.values()),
+            )
+            for stream, event_id, fields in events:
+                stream = stream.decode()
+                latest_ids[stream] = event_id
+                if stream == config.CACHE_EVICTION_STREAM:
+                    _evict_locally(fields)
+                else:
+                    await _handle_change(event_id, fields)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Failed to process cache invalidation events")
+            await asyncio.sleep(1)
+
+
+def normalize_text(value: str) -> str:
+    """
+    Поисковая строка в каноническом виде: NFKC, без учёта регистра,
+    без пробелов по краям и с одиночными пробелами между словами.
+    """
+    return " ".join(unicodedata.normalize("NFKC", value).casefold().split())
+
+
+def _digest(raw: str) -> str:
+    """Хеш фиксированной длины для ключа кеша."""
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def build_key(model_name: str, fn_name: str, args: tuple) -> str:
+    """
+    Ключ кеша для вызова метода сервиса по значениям его аргументов (без self).
+    Аргументы хешируются, поэтому длина ключа не зависит от запроса.
+    """
+    key_args = "\x1f".join(repr(a) for a in args)
+    return f"{model_name}|{fn_name}|{_digest(key_args)}"
+
+
+def _canonical_call(
+    signature: inspect.Signature, args: tuple, kwargs: dict, normalize: Tuple[str, ...]
+) -> Tuple[tuple, dict]:
+    """
+    Аргументы вызова в каноническом виде: позиционные и именованные приводятся
+    к одному виду, пропущенные заполняются значениями по умолчанию,
+    текстовые аргументы из normalize нормализуются.
+    """
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    for arg_name in normalize:
+        value = bound.arguments.get(arg_name)
+        if isinstance(value, str):
+            bound.arguments[arg_name] = normalize_text(value)
+    return bound.args, bound.kwargs
+
+
+async def get_many_cached(
+    model: Type[BaseApiModel],
+    fn_name: str,
+    ids: List[str],
+    fetch_many: Callable[[List[str]], Awaitable[List[BaseApiModel]]],
+    ttl: int,
+    stale_ttl: Optional[int] = None,
+) -> List[BaseApiModel]:
+    """
+    Пакетное получение документов по id в тех же ключах кеша, что и у
+    метода fn_name, обёрнутого в async_cache: один MGET в Redis, один запрос
+    fetch_many за промахами и одна пачка SET через пайплайн.
+    Возвращает найденные документы в порядке ids.
+    """
+    name = model.__name__
+    ids = list(dict.fromkeys(ids))
+    keys = {doc_id: build_key(model.__name__, fn_name, (doc_id,)) for doc_id in ids}
+    found: Dict[str, BaseApiModel] = {}
+
+    if local_cache is not None:
+        for doc_id, key in keys.items():
+            data = local_cache.get(key)
+            if data is not None:
+                found[doc_id] = data.copy()
+        _count("local", "hit", name, fn_name, len(found))
+        _count("local", "miss", name, fn_name, len(ids) - len(found))
+
+    missing = [doc_id for doc_id in ids if doc_id not in found]
+    if missing:
+        with timer("cache_lookup", f"{name}.{fn_name}"):
+            raws = await redis.mget(*(keys[doc_id] for doc_id in missing))
+        hits = 0
+        with timer("cache_parse", f"{name}.{fn_name}"):
+            for doc_id, raw in zip(missing, raws):
+                unpacked = codec.loads(raw) if raw else None
+                if unpacked is not None:
+                    found[doc_id] = model.parse_obj(unpacked.data)
+                    hits += 1
+        _count("redis", "hit", name, fn_name, hits)
+        _count("redis", "miss", name, fn_name, len(missing) - hits)
+        missing = [doc_id for doc_id in missing if doc_id not in found]
+
+    if missing:
+        started = time.time()
+        fetched = await fetch_many(missing)
+        now = time.time()
+        stale_at = now + min(stale_ttl or ttl, ttl)
+        delta = now - started
+        entries = []
+        for data in fetched:
+            doc_id = next(iter(_collect_ids(data)))
+            packed = codec.dumps(data.dict(), stale_at, delta)
+            entries.append((keys[doc_id], packed.raw, {doc_id}))
+            if local_cache is not None:
+                local_cache.set(keys[doc_id], data, packed.size, int(stale_at - now))
+            found[doc_id] = data
+        if entries:
+            with timer("cache_store", f"{name}.{fn_name}"):
+                await _set_many_with_tags(entries, ttl)
+
+    return [found[doc_id] for doc_id in ids if doc_id in found]
+
+
 def async_cache(
-    model: Type[BaseApiModel] = None, page: bool = False, ttl: int = 60
+    model: Type[BaseApiModel] = None,
+    page: bool = False,
+    ttl: int = 60,
+    stale_ttl: Optional[int] = None,
+    beta: float = 1.0,
+    normalize: Tuple[str, ...] = (),
+    tags: Tuple[str, ...] = (),
 ) -> Callable:
+    """
+    Кеширование результата метода сервиса в Redis (и в локальном кеше воркера).
+
+    ttl - время жизни ключа в Redis.
+    stale_ttl - через сколько секунд значение считается устаревшим: оно ещё
+    отдаётся клиенту, но в фоне запускается обновление. По умолчанию равно ttl.
+    beta - коэффициент досрочного вероятностного обновления (XFetch),
+    0 отключает досрочное обновление.
+    normalize - имена текстовых аргументов (поисковых строк), которые
+    нормализуются перед построением ключа и вызовом метода.
+    tags - имена аргументов с id документов, по которым значение тоже
+    инвалидируется, хотя самих документов среди результатов нет
+    (например, персона для страницы её фильмов).
+    """
+    stale_ttl = min(stale_ttl or ttl, ttl)
+    using_model = Page[model] if page else model
+
+    def _parse(payload: Any, name: str) -> Any:
+        with timer("cache_parse", name):
+            data = using_model.parse_obj(payload)
+            if page:
+                data.items = [model(**d) for d in data.items]
+        return data
+
+    def _cache_locally(key: str, data: Any, size: int, stale_at: float) -> None:
+        if local_cache is not None:
+            local_cache.set(key, data, size, max(int(stale_at - time.time()), 1))
+
     def _cache(fn):
+        name = f"{model.__name__}.{fn.__name__}"
+        signature = inspect.signature(fn)
+
+        def _count_for(tier: str, result: str) -> None:
+            _count(tier, result, model.__name__, fn.__name__)
+
+        async def _fetch(key: str, args: tuple, kwargs: dict) -> Any:
+            started = time.time()
+            data = await fn(*args, **kwargs)
+            if not data:
+                return data
+            now = time.time()
+            stale_at = now + stale_ttl
+            with timer("cache_store", name):
+                packed = codec.dumps(data.dict(), stale_at, now - started)
+                ids = _collect_ids(data)
+                if tags:
+                    arguments = signature.bind(*args, **kwargs).arguments
+                    ids |= _argument_tags(arguments, tags)
+                await _set_with_tags(key, packed.raw, ttl, ids)
+            _cache_locally(key, data, packed.size, stale_at)
+            return data
+
+        async def _fetch_locked(key: str, args: tuple, kwargs: dict) -> Any:
+            token = await _acquire_lock(key)
+            if token is None:
+                raw = await _wait_for_value(key)
+                unpacked = codec.loads(raw) if raw else None
+                if unpacked is not None:
+                    return _parse(unpacked.data, name)
+                return await _fetch(key, args, kwargs)
+            try:
+                return await _fetch(key, args, kwargs)
+            finally:
+                await _release_lock(key, token)
+
+        async def _refresh(key: str, args: tuple, kwargs: dict) -> None:
+            """Фоновое обновление устаревшего значения."""
+            try:
+                if not config.CACHE_LOCK_ENABLED:
+                    await _fetch(key, args, kwargs)
+                    return
+                token = await _acquire_lock(key)
+                if token is None:
+                    # Значение уже обновляет другой воркер.
+                    return
+                try:
+                    await _fetch(key, args, kwargs)
+                finally:
+                    await _release_lock(key, token)
+            except Exception:
+                logger.exception("Background refresh of %s failed", key)
+
+        def _schedule_refresh(key: str, args: tuple, kwargs: dict) -> None:
+            if key in _refreshing:
+                return
+            _count_for("redis", "refresh")
+            task = asyncio.ensure_future(_refresh(key, args, kwargs))
+            _refreshing[key] = task
+            task.add_done_callback(lambda _: _refreshing.pop(key, None))
+
+        async def _load(key: str, args: tuple, kwargs: dict) -> Any:
+            with timer("cache_lookup", name):
+                raw = await redis.get(key)
+            # Значение в другом формате (или старой версии формата) - промах:
+            # оно будет перезаписано в текущем.
+            unpacked = codec.loads(raw) if raw else None
+            if unpacked is not None:
+                _count_for("redis", "hit")
+                data = _parse(unpacked.data, name)
+                if _should_refresh(unpacked.stale_at, unpacked.delta, beta):
+                    # Отдаём текущее значение, обновляем в фоне.
+                    _schedule_refresh(key, args, kwargs)
+                else:
+                    _cache_locally(key, data, unpacked.size, unpacked.stale_at)
+                return data
+            _count_for("redis", "miss")
+
+            if not config.CACHE_LOCK_ENABLED:
+                return await _fetch(key, args, kwargs)
+            return await _fetch_locked(key, args, kwargs)
+
         @wraps(fn)
         async def _wrapper(*args, **kwargs):
-            using_model = Page[model] if page else model
-
-            key_args = "|".join(str(a) for a in args[1:])
-            key_kwargs = "|".join(f"{k}={v}" for k, v in kwargs.items())
-            key = f"{model.__name__}|{fn.__name__}|{key_args}|{key_kwargs}"
-            data = await redis.get(key)
-            if data:
-                data = using_model.parse_raw(data)
-                if page:
-                    data.items = [model(**d) for d in data.items]
+            args, kwargs = _canonical_call(signature, args, kwargs, normalize)
+            key = build_key(
+                model.__name__, fn.__name__, args[1:] + tuple(sorted(kwargs.items()))
+            )
+
+            if local_cache is not None:
+                data = local_cache.get(key)
+                if data is not None:
+                    _count_for("local", "hit")
+                    # Копия защищает закешированный объект от изменений
+                    # в обработчиках (например, подмены page.items).
+                    return data.copy()
+                _count_for("local", "miss")
+
+            flight = _in_flight.get(key)
+            if flight is None:
+                flight = asyncio.ensure_future(_load(key, args, kwargs))
+                _in_flight[key] = flight
+                flight.add_done_callback(lambda _: _in_flight.pop(key, None))
             else:
-                data = await fn(*args, **kwargs)
-                if data:
-                    await redis.set(key, data.json(), expire=ttl)
+                _count_for("flight", "joined")
 
-            return data
+            # shield: отмена одного из ожидающих запросов не отменяет
+            # общую загрузку для остальных.
+            data = await asyncio.shield(flight)
+            return data.copy() if data else data
+
+        return _wrapper
+
+    return _cache
+
+
+def cached_response(
+    ttl: int = 60,
+    normalize: Tuple[str, ...] = (),
+    tags: Tuple[str, ...] = (),
+) -> Callable:
+    """
+    Кеширование готового тела ответа ручки по её имени и параметрам запроса.
+    При попадании байты отдаются как есть, без построения моделей и сериализации.
+    normalize - имена текстовых параметров, которые нормализуются, как в async_cache.
+    tags - имена параметров с id документов для тегов, как в async_cache.
+    """
+
+    def _cache(fn):
+        module = fn.__module__.rsplit(".", 1)[-1]
+        name = f"{module}.{fn.__name__}"
+
+        @wraps(fn)
+        async def _wrapper(**kwargs):
+            for param in normalize:
+                if isinstance(kwargs.get(param), str):
+                    kwargs[param] = normalize_text(kwargs[param])
+            params = "|".join(
+                f"{k}={v!r}"
+                for k, v in sorted(kwargs.items())
+                if v is None or isinstance(v, (str, int, float))
+            )
+            key = f"response|{fn.__module__}.{fn.__name__}|{_digest(params)}"
+
+            body = local_cache.get(key) if local_cache is not None else None
+            if body is None:
+                with timer("cache_lookup", name):
+                    raw = await redis.get(key)
+                unpacked = codec.loads(raw) if raw else None
+                body = unpacked.data if unpacked is not None else None
+                if body and local_cache is not None:
+                    local_cache.set(key, body, len(body), ttl)
+            if body:
+                _count("response", "hit", module, fn.__name__)
+                return Response(content=body, media_type="application/json")
+            _count("response", "miss", module, fn.__name__)
+
+            result = await fn(**kwargs)
+            if isinstance(result, Response):
+                return result
+            ids = _collect_ids(result) | _argument_tags(kwargs, tags)
+            with timer("serialize", name):
+                body = orjson.dumps(jsonable_encoder(result))
+            with timer("cache_store", name):
+                await _set_with_tags(key, codec.dumps_raw(body).raw, ttl, ids)
+            if local_cache is not None:
+                local_cache.set(key, body, len(body), ttl)
+            return Response(content=body, media_type="application/json")
 
         return _wrapper
 
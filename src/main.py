@@ -1,12 +1,19 @@
+import asyncio
+from http import HTTPStatus
+
 import aioredis
 import uvicorn
-from elasticsearch import AsyncElasticsearch
-from fastapi import FastAPI
-from fastapi.responses import ORJSONResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse, Response
 
 from api.v1 import film, genre, person
-from core import config
+from core import config, metrics
 from db import elastic, redis
+from db.memory import LRUCache
+from models.constants import INVALID_CURSOR
+from services.genre import genre_snapshot
+from services.pagination import InvalidCursorError
+from services.warmup import log_warmup_error, warm_up_once
 
 app = FastAPI(
     title=config.PROJECT_NAME,
@@ -14,6 +21,10 @@ app = FastAPI(
     openapi_url="/api/openapi.json",
     default_response_class=ORJSONResponse,
 )
+app.add_middleware(
+    metrics.LatencyMiddleware,
+    collect=lambda: metrics.set_pool_stats(elastic.get_pool_stats()),
+)
 
 
 @app.on_event("startup")
@@ -21,17 +32,63 @@ async def startup():
     redis.redis = await aioredis.create_redis_pool(
         (config.REDIS_HOST, config.REDIS_PORT), minsize=10, maxsize=20
     )
-    elastic.es = AsyncElasticsearch(
-        hosts=[f"{config.ELASTIC_HOST}:{config.ELASTIC_PORT}"]
-    )
+    if config.CACHE_LOCAL_ENABLED:
+        redis.local_cache = LRUCache(
+            config.CACHE_LOCAL_MAX_ITEMS,
+            config.CACHE_LOCAL_MAX_BYTES,
+            config.CACHE_LOCAL_TTL,
+        )
+    elastic.es = elastic.create_elastic()
+
+    if config.SNAPSHOT_ENABLED:
+        # Снимок загружается в фоне, до этого жанры отдаются из ES и кеша.
+        app.state.snapshot_refresher = asyncio.ensure_future(
+            genre_snapshot.keep_fresh(config.SNAPSHOT_REFRESH_INTERVAL)
+        )
+        redis.change_handlers["genres"] = [genre_snapshot.request_refresh]
+    if config.CACHE_INVALIDATION_ENABLED:
+        app.state.invalidation_redis = await aioredis.create_redis(
+            (config.REDIS_HOST, config.REDIS_PORT)
+        )
+        app.state.invalidation_listener = asyncio.ensure_future(
+            redis.listen_invalidations(app.state.invalidation_redis)
+        )
+    if config.WARMUP_ENABLED:
+        # Прогрев идёт в фоне и не задерживает запуск приложения.
+        app.state.warmup = asyncio.ensure_future(warm_up_once())
+        app.state.warmup.add_done_callback(log_warmup_error)
 
 
 @app.on_event("shutdown")
 async def shutdown():
+    if config.SNAPSHOT_ENABLED:
+        app.state.snapshot_refresher.cancel()
+    if config.CACHE_INVALIDATION_ENABLED:
+        app.state.invalidation_listener.cancel()
+        app.state.invalidation_redis.close()
+        await app.state.invalidation_redis.wait_closed()
+    if config.WARMUP_ENABLED:
+        app.state.warmup.cancel()
     await redis.redis.close()
     await elastic.es.close()
 
 
+@app.exception_handler(InvalidCursorError)
+async def invalid_cursor_handler(
+    request: Request, exc: InvalidCursorError
+) -> ORJSONResponse:
+    return ORJSONResponse(
+        status_code=HTTPStatus.BAD_REQUEST, content={"detail": INVALID_CURSOR}
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics() -> Response:
+    metrics.set_pool_stats(elastic.get_pool_stats())
+    content, content_type = metrics.render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
 # Подключаем роутер к серверу, указав префикс /v1/film
 # Теги указываем для удобства навигации по документации
 app.include_router(film.router, prefix="/api/v1/film", tags=["film"])
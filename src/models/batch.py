@@ -0,0 +1,19 @@
+from typing import List
+
+from pydantic import Field
+
+from .base import BaseApiModel
+
+# Максимальное количество id в одном пакетном запросе
+BATCH_MAX_IDS = 100
+
+
+class BatchRequest(BaseApiModel):
+    """Запрос на получение нескольких объектов по списку id."""
+
+    ids: List[str] = Field(
+        ...,
+        title="List of ids",
+        min_items=1,
+        max_items=BATCH_MAX_IDS,
+    )
@@ -3,3 +3,12 @@ PERSON_NOT_FOUND = "person not found"
 GENRE_NOT_FOUND = "genre not found"
 
 FILM_NOT_FOUND = "film not found"
+
+INVALID_CURSOR = "invalid page cursor"
+
+# Максимальный размер страницы в ручках списков
+MAX_PAGE_SIZE = 100
+
+# Максимальное число подсказок в ручках suggest и длина строки запроса
+MAX_SUGGEST_SIZE = 20
+MAX_SUGGEST_QUERY_LENGTH = 100
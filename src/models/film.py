@@ -18,6 +18,14 @@ class Film(BaseApiModel):
     genres: Optional[List[Dict]] = [{}]
 
 
+class FilmShort(BaseApiModel):
+    """Фильм в списках и поиске: только поля, которые отдают эти ручки."""
+
+    id: str
+    title: str
+    imdb_rating: float
+
+
 class FilmPerson(BaseApiModel):
     uuid: str
     title: str
@@ -31,6 +39,11 @@ class ResponseFilm(BaseApiModel):
     imdb_rating: float
 
 
+class FilmSuggestion(BaseApiModel):
+    uuid: str
+    title: str
+
+
 class ResponseFilmDetail(BaseApiModel):
     uuid: str
     title: str
@@ -1,4 +1,4 @@
-from typing import Generic, List, TypeVar
+from typing import Generic, List, Optional, TypeVar
 
 from pydantic import Field
 
@@ -28,3 +28,7 @@ class Page(BaseApiModel, Generic[ElasticModel]):
         title="Total items",
         example=35,
     )
+    next_cursor: Optional[str] = Field(
+        title="Cursor of the next page",
+        default=None,
+    )
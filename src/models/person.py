@@ -1,20 +1,27 @@
-from typing import List
-
 from .base import BaseApiModel
-from .film import FilmPerson
 
 
 class Person(BaseApiModel):
     uuid: str
     full_name: str
-    films: List[FilmPerson] = []
+
+
+class PersonFilm(BaseApiModel):
+    """Связь персоны с фильмом: документ индекса person_films."""
+
+    id: str
+    person_id: str
+    film_id: str
+    title: str
+    imdb_rating: float
+    role: str
 
 
 class ResponsePerson(BaseApiModel):
     uuid: str
     full_name: str
-    films: List[FilmPerson] = []
 
 
-class ResponsePersonFilms(BaseApiModel):
-    films: List[FilmPerson] = []
+class PersonSuggestion(BaseApiModel):
+    uuid: str
+    full_name: str
@@ -1,16 +1,20 @@
 from functools import lru_cache
-from typing import Optional
+from typing import List, Optional
 
 from aioredis import Redis
 from elasticsearch import AsyncElasticsearch, exceptions
 from fastapi import Depends
 
+from core.metrics import timer
 from db.elastic import get_elastic
-from db.redis import async_cache, get_redis
-from models.film import Film
+from db.redis import async_cache, get_many_cached, get_redis
+from models.film import Film, FilmShort, FilmSuggestion
 from models.page import Page
+from services.pagination import get_next_cursor, paginate
 
 FILM_CACHE_EXPIRE_IN_SECONDS = 60 * 60
+# Через это время значение в кеше считается устаревшим и обновляется в фоне
+FILM_CACHE_STALE_IN_SECONDS = 50 * 60  # 50 минут
 
 
 class FilmService:
@@ -18,34 +22,98 @@ class FilmService:
         self.redis = redis
         self.elastic = elastic
 
-    @async_cache(Film, page=False, ttl=FILM_CACHE_EXPIRE_IN_SECONDS)
+    @async_cache(
+        Film,
+        page=False,
+        ttl=FILM_CACHE_EXPIRE_IN_SECONDS,
+        stale_ttl=FILM_CACHE_STALE_IN_SECONDS,
+    )
     async def get_by_id(self, film_id: str) -> Optional[Film]:
         film = await self._get_film_from_elastic(film_id)
         return film
 
-    @async_cache(Film, page=True, ttl=FILM_CACHE_EXPIRE_IN_SECONDS)
+    @async_cache(
+        FilmShort,
+        page=True,
+        ttl=FILM_CACHE_EXPIRE_IN_SECONDS,
+        stale_ttl=FILM_CACHE_STALE_IN_SECONDS,
+    )
     async def get_list(
-        self, sort: str, page_size: int, page_number: int, filter_genre: str
-    ) -> Page[Film]:
+        self,
+        sort: str,
+        page_size: int,
+        page_number: int,
+        filter_genre: str,
+        cursor: Optional[str] = None,
+    ) -> Page[FilmShort]:
         result = await self._get_list_from_elastic(
-            sort, page_number, page_size, filter_genre
+            sort, page_number, page_size, filter_genre, cursor
         )
         return result
 
-    @async_cache(Film, page=True, ttl=FILM_CACHE_EXPIRE_IN_SECONDS)
-    async def search(self, query: str, page_number: int, page_size: int) -> Page[Film]:
-        result = await self._search_film_from_elastic(query, page_number, page_size)
+    @async_cache(
+        FilmShort,
+        page=True,
+        ttl=FILM_CACHE_EXPIRE_IN_SECONDS,
+        stale_ttl=FILM_CACHE_STALE_IN_SECONDS,
+        normalize=("query",),
+    )
+    async def search(
+        self,
+        query: str,
+        page_number: int,
+        page_size: int,
+        cursor: Optional[str] = None,
+    ) -> Page[FilmShort]:
+        result = await self._search_film_from_elastic(
+            query, page_number, page_size, cursor
+        )
         return result
 
+    async def suggest(self, query: str, size: int) -> List[FilmSuggestion]:
+        """Подсказки по началу слов названия, самые популярные фильмы первыми."""
+        # size 0: обычные хиты не нужны, только подсказки
+        body = {
+            "size": 0,
+            "_source": ["id", "title"],
+            "suggest": {
+                "films": {
+                    "prefix": query,
+                    "completion": {"field": "suggest", "size": size},
+                }
+            },
+        }
+        doc = await self.elastic.search(index="movies", body=body)
+        options = doc["suggest"]["films"][0]["options"]
+        return [
+            FilmSuggestion(uuid=film["_source"]["id"], title=film["_source"]["title"])
+            for film in options
+        ]
+
+    async def get_many(self, film_ids: List[str]) -> List[Film]:
+        return await get_many_cached(
+            Film,
+            "get_by_id",
+            film_ids,
+            self._get_films_from_elastic,
+            FILM_CACHE_EXPIRE_IN_SECONDS,
+            FILM_CACHE_STALE_IN_SECONDS,
+        )
+
     async def _get_list_from_elastic(
-        self, sort: str, page_number: int, page_size: int, filter_genre: str
-    ) -> Page[Film]:
+        self,
+        sort: str,
+        page_number: int,
+        page_size: int,
+        filter_genre: str,
+        cursor: Optional[str] = None,
+    ) -> Page[FilmShort]:
         order = "asc"
         if sort.startswith("-"):
             order = "desc"
             sort = sort[1:]
 
-        body = {"sort": {sort: {"order": order}}}
+        body = {}
 
         if filter_genre:
             body["query"] = {
@@ -62,11 +130,13 @@ class FilmService:
                     }
                 }
             }
-        return await self._get_pages_from_elastic(body, page_number, page_size)
+        return await self._get_pages_from_elastic(
+            body, [{sort: {"order": order}}], page_number, page_size, cursor
+        )
 
     async def _search_film_from_elastic(
-        self, query: str, page_number: int, page_size: int
-    ) -> Page[Film]:
+        self, query: str, page_number: int, page_size: int, cursor: Optional[str]
+    ) -> Page[FilmShort]:
         body = {
             "query": {
                 "multi_match": {
@@ -77,21 +147,34 @@ class FilmService:
                 }
             }
         }
-        return await self._get_pages_from_elastic(body, page_number, page_size)
+        return await self._get_pages_from_elastic(
+            body, ["_score"], page_number, page_size, cursor
+        )
 
     async def _get_pages_from_elastic(
-        self, body: dict, page_number: int, page_size: int
-    ) -> Page[Film]:
-        body["from"] = (page_number - 1) * page_size
-        body["size"] = page_size
+        self,
+        body: dict,
+        sort: list,
+        page_number: int,
+        page_size: int,
+        cursor: Optional[str],
+    ) -> Page[FilmShort]:
+        body = paginate(body, sort, "id", page_number, page_size, cursor)
+        # Из ES забираем только поля, нужные для списков, а не весь документ
+        # с актёрами, сценаристами и жанрами.
+        body["_source"] = list(FilmShort.__fields__)
 
         doc = await self.elastic.search(index="movies", body=body)
 
+        hits = doc["hits"]["hits"]
+        with timer("model", "FilmShort"):
+            items = [FilmShort(**film["_source"]) for film in hits]
         return Page(
-            items=[Film(**film["_source"]) for film in doc["hits"]["hits"]],
+            items=items,
             page_number=page_number,
             page_size=page_size,
             total=doc["hits"]["total"]["value"],
+            next_cursor=get_next_cursor(hits, page_size),
         )
 
     async def _get_film_from_elastic(self, film_id: str) -> Optional[Film]:
@@ -101,6 +184,11 @@ class FilmService:
             return
         return Film(**doc["_source"])
 
+    async def _get_films_from_elastic(self, film_ids: List[str]) -> List[Film]:
+        doc = await self.elastic.mget(index="movies", body={"ids": film_ids})
+        with timer("model", "Film"):
+            return [Film(**d["_source"]) for d in doc["docs"] if d.get("found")]
+
 
 @lru_cache()
 def get_film_service(
@@ -1,16 +1,49 @@
+import logging
 from functools import lru_cache
-from typing import Optional
+from typing import List, Optional
 
 from aioredis import Redis
 from elasticsearch import AsyncElasticsearch, exceptions
 from fastapi import Depends
 
+from core import config
+from core.metrics import timer
+from db import elastic as es_db
 from db.elastic import get_elastic
-from db.redis import async_cache, get_redis
+from db.redis import async_cache, get_many_cached, get_redis
 from models.genre import Genre
 from models.page import Page
+from services.pagination import get_next_cursor, paginate
+from services.snapshot import ReferenceSnapshot
+
+logger = logging.getLogger(__name__)
 
 GENRE_CACHE_EXPIRE_IN_SECONDS = 60 * 60  # 1 час
+# Через это время значение в кеше считается устаревшим и обновляется в фоне
+GENRE_CACHE_STALE_IN_SECONDS = 50 * 60  # 50 минут
+
+
+async def _load_genres() -> Optional[List[Genre]]:
+    """Все жанры для снимка в памяти или None, если их слишком много."""
+    body = {"sort": [{"id": "asc"}], "size": config.SNAPSHOT_MAX_ITEMS}
+    doc = await es_db.es.search(index="genres", body=body)
+    total = doc["hits"]["total"]["value"]
+    if total > config.SNAPSHOT_MAX_ITEMS:
+        logger.warning(
+            "Genres snapshot disabled: %s genres, limit %s",
+            total,
+            config.SNAPSHOT_MAX_ITEMS,
+        )
+        return None
+    with timer("model", "Genre"):
+        return [Genre(**d["_source"]) for d in doc["hits"]["hits"]]
+
+
+# Справочник жанров в памяти воркера. Загружается при старте приложения
+# и обновляется по таймеру и по событиям из ETL.
+genre_snapshot: ReferenceSnapshot[Genre] = ReferenceSnapshot(
+    "genres", _load_genres, key=lambda genre: genre.id
+)
 
 
 class GenreService:
@@ -18,21 +51,60 @@ class GenreService:
         self.redis = redis
         self.elastic = elastic
 
-    @async_cache(Genre, False, GENRE_CACHE_EXPIRE_IN_SECONDS)
     async def get_by_id(self, genre_id: str) -> Optional[Genre]:
+        if genre_snapshot.ready:
+            return genre_snapshot.get(genre_id)
+        return await self._get_by_id(genre_id)
+
+    async def get_list(
+        self, page_size: int, page_number: int, cursor: Optional[str] = None
+    ) -> Page:
+        if genre_snapshot.ready:
+            return genre_snapshot.page(page_size, page_number, cursor)
+        return await self._get_list(page_size, page_number, cursor)
+
+    async def get_many(self, genre_ids: List[str]) -> List[Genre]:
+        if genre_snapshot.ready:
+            return genre_snapshot.get_many(genre_ids)
+        return await get_many_cached(
+            Genre,
+            "_get_by_id",
+            genre_ids,
+            self._get_genres_from_elastic,
+            GENRE_CACHE_EXPIRE_IN_SECONDS,
+            GENRE_CACHE_STALE_IN_SECONDS,
+        )
+
+    @async_cache(
+        Genre,
+        False,
+        GENRE_CACHE_EXPIRE_IN_SECONDS,
+        stale_ttl=GENRE_CACHE_STALE_IN_SECONDS,
+    )
+    async def _get_by_id(self, genre_id: str) -> Optional[Genre]:
         genre = await self._get_genre_from_elastic(genre_id)
         return genre
 
-    @async_cache(Genre, True, GENRE_CACHE_EXPIRE_IN_SECONDS)
-    async def get_list(self, page_size: int, page_number: int) -> Page:
-        doc = await self.elastic.search(
-            index="genres", size=page_size, from_=(page_number - 1) * page_size
-        )
+    @async_cache(
+        Genre,
+        True,
+        GENRE_CACHE_EXPIRE_IN_SECONDS,
+        stale_ttl=GENRE_CACHE_STALE_IN_SECONDS,
+    )
+    async def _get_list(
+        self, page_size: int, page_number: int, cursor: Optional[str] = None
+    ) -> Page:
+        body = paginate({}, [], "id", page_number, page_size, cursor)
+        doc = await self.elastic.search(index="genres", body=body)
+        hits = doc["hits"]["hits"]
+        with timer("model", "Genre"):
+            items = [Genre(**d["_source"]) for d in hits]
         return Page(
-            items=[Genre(**d["_source"]) for d in doc["hits"]["hits"]],
+            items=items,
             page_number=page_number,
             page_size=page_size,
             total=doc["hits"]["total"]["value"],
+            next_cursor=get_next_cursor(hits, page_size),
         )
 
     async def _get_genre_from_elastic(self, genre_id: str) -> Optional[Genre]:
@@ -42,6 +114,11 @@ class GenreService:
             return
         return Genre(**doc["_source"])
 
+    async def _get_genres_from_elastic(self, genre_ids: List[str]) -> List[Genre]:
+        doc = await self.elastic.mget(index="genres", body={"ids": genre_ids})
+        with timer("model", "Genre"):
+            return [Genre(**d["_source"]) for d in doc["docs"] if d.get("found")]
+
 
 @lru_cache()
 def get_genre_service(
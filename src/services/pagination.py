@@ -0,0 +1,63 @@
+import base64
+import binascii
+from typing import List, Optional, Union
+
+import orjson
+
+
+class InvalidCursorError(ValueError):
+    """Курсор страницы не удалось разобрать."""
+
+
+def encode_cursor(sort_values: list) -> str:
+    """Непрозрачный курсор из значений сортировки последнего документа страницы."""
+    return base64.urlsafe_b64encode(orjson.dumps(sort_values)).decode()
+
+
+def decode_cursor(cursor: str, length: int) -> list:
+    """
+    Значения сортировки для search_after из курсора. Их должно быть length
+    (поля сортировки и tiebreaker), и каждое - скаляр, иначе курсор
+    не от этой сортировки, и ES ответил бы ошибкой.
+    """
+    try:
+        sort_values = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, orjson.JSONDecodeError, ValueError):
+        raise InvalidCursorError(cursor)
+    if not isinstance(sort_values, list) or len(sort_values) != length:
+        raise InvalidCursorError(cursor)
+    if not all(
+        value is None or isinstance(value, (str, int, float)) for value in sort_values
+    ):
+        raise InvalidCursorError(cursor)
+    return sort_values
+
+
+def paginate(
+    body: dict,
+    sort: List[Union[str, dict]],
+    tiebreaker: str,
+    page_number: int,
+    page_size: int,
+    cursor: Optional[str] = None,
+) -> dict:
+    """
+    Добавить в тело запроса к ES сортировку и пагинацию.
+    Сортировка дополняется уникальным полем tiebreaker, чтобы порядок был
+    однозначным. С курсором страница выбирается через search_after и стоит
+    одинаково на любой глубине, без курсора - через from/size.
+    """
+    body["sort"] = [*sort, {tiebreaker: "asc"}]
+    body["size"] = page_size
+    if cursor:
+        body["search_after"] = decode_cursor(cursor, len(body["sort"]))
+    else:
+        body["from"] = (page_number - 1) * page_size
+    return body
+
+
+def get_next_cursor(hits: list, page_size: int) -> Optional[str]:
+    """Курсор следующей страницы или None, если страница последняя."""
+    if len(hits) < page_size:
+        return None
+    return encode_cursor(hits[-1]["sort"])
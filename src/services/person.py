@@ -1,16 +1,22 @@
 from functools import lru_cache
-from typing import Optional
+from typing import List, Optional
 
 from aioredis import Redis
 from elasticsearch import AsyncElasticsearch, exceptions
 from fastapi import Depends
 
+from core.metrics import timer
 from db.elastic import get_elastic
-from db.redis import async_cache, get_redis
+from db.redis import async_cache, get_many_cached, get_redis
 from models.page import Page
-from models.person import Person
+from models.person import Person, PersonFilm, PersonSuggestion
+from services.pagination import get_next_cursor, paginate
 
 GENRE_PERSON_EXPIRE_IN_SECONDS = 60 * 60  # 1 час
+# Через это время значение в кеше считается устаревшим и обновляется в фоне
+PERSON_CACHE_STALE_IN_SECONDS = 50 * 60  # 50 минут
+# Поля сортировки фильмов персоны и соответствующие им поля индекса
+PERSON_FILMS_SORT_FIELDS = {"imdb_rating": "imdb_rating", "title": "title.raw"}
 
 
 class PersonService:
@@ -18,14 +24,29 @@ class PersonService:
         self.redis = redis
         self.elastic = elastic
 
-    @async_cache(Person, page=False, ttl=GENRE_PERSON_EXPIRE_IN_SECONDS)
+    @async_cache(
+        Person,
+        page=False,
+        ttl=GENRE_PERSON_EXPIRE_IN_SECONDS,
+        stale_ttl=PERSON_CACHE_STALE_IN_SECONDS,
+    )
     async def get_by_id(self, person_id: str) -> Optional[Person]:
         person = await self._get_person_from_elastic(person_id)
         return person
 
-    @async_cache(Person, page=True, ttl=GENRE_PERSON_EXPIRE_IN_SECONDS)
+    @async_cache(
+        Person,
+        page=True,
+        ttl=GENRE_PERSON_EXPIRE_IN_SECONDS,
+        stale_ttl=PERSON_CACHE_STALE_IN_SECONDS,
+        normalize=("query",),
+    )
     async def search(
-        self, query: str, page_size: int, page_number: int
+        self,
+        query: str,
+        page_size: int,
+        page_number: int,
+        cursor: Optional[str] = None,
     ) -> Page[Person]:
         body = {
             "query": {
@@ -38,15 +59,85 @@ class PersonService:
                 }
             }
         }
-        start_page = (page_number - 1) * page_size
-        doc = await self.elastic.search(
-            index="person", body=body, size=page_size, from_=start_page
+        body = paginate(body, ["_score"], "uuid", page_number, page_size, cursor)
+        doc = await self.elastic.search(index="person", body=body)
+        hits = doc["hits"]["hits"]
+        with timer("model", "Person"):
+            items = [Person(**person["_source"]) for person in hits]
+        return Page(
+            items=items,
+            page_number=page_number,
+            page_size=page_size,
+            total=doc["hits"]["total"]["value"],
+            next_cursor=get_next_cursor(hits, page_size),
+        )
+
+    @async_cache(
+        PersonFilm,
+        page=True,
+        ttl=GENRE_PERSON_EXPIRE_IN_SECONDS,
+        stale_ttl=PERSON_CACHE_STALE_IN_SECONDS,
+        tags=("person_id",),
+    )
+    async def get_films(
+        self,
+        person_id: str,
+        sort: str,
+        page_size: int,
+        page_number: int,
+        role: Optional[str] = None,
+        cursor: Optional[str] = None,
+    ) -> Page[PersonFilm]:
+        order = "asc"
+        if sort.startswith("-"):
+            order = "desc"
+            sort = sort[1:]
+        sort = PERSON_FILMS_SORT_FIELDS.get(sort, sort)
+
+        filters = [{"term": {"person_id": person_id}}]
+        if role:
+            filters.append({"term": {"role": role}})
+        body = {"query": {"bool": {"filter": filters}}}
+        body = paginate(
+            body, [{sort: {"order": order}}], "id", page_number, page_size, cursor
         )
+        doc = await self.elastic.search(index="person_films", body=body)
+        hits = doc["hits"]["hits"]
+        with timer("model", "PersonFilm"):
+            items = [PersonFilm(**relation["_source"]) for relation in hits]
         return Page(
-            items=[Person(**person["_source"]) for person in doc["hits"]["hits"]],
+            items=items,
             page_number=page_number,
             page_size=page_size,
             total=doc["hits"]["total"]["value"],
+            next_cursor=get_next_cursor(hits, page_size),
+        )
+
+    async def suggest(self, query: str, size: int) -> List[PersonSuggestion]:
+        """Подсказки по началу слов имени персоны."""
+        # size 0: обычные хиты не нужны, только подсказки
+        body = {
+            "size": 0,
+            "_source": ["uuid", "full_name"],
+            "suggest": {
+                "persons": {
+                    "prefix": query,
+                    "completion": {"field": "suggest", "size": size},
+                }
+            },
+        }
+        doc = await self.elastic.search(index="person", body=body)
+        options = doc["suggest"]["persons"][0]["options"]
+        return [PersonSuggestion(**person["_source"]) for person in options]
+
+    async def get_many(self, person_ids: List[str]) -> List[Person]:
+        return await get_many_cached(
+            Person,
+            "get_by_id",
+            person_ids,
+            self._get_persons_from_elastic,
+            GENRE_PERSON_EXPIRE_IN_SECONDS,
+            PERSON_CACHE_STALE_IN_SECONDS,
         )
 
     async def _get_person_from_elastic(self, person_id: str) -> Optional[Person]:
@@ -56,6 +147,11 @@ class PersonService:
             return
         return Person(**doc["_source"])
 
+    async def _get_persons_from_elastic(self, person_ids: List[str]) -> List[Person]:
+        doc = await self.elastic.mget(index="person", body={"ids": person_ids})
+        with timer("model", "Person"):
+            return [Person(**d["_source"]) for d in doc["docs"] if d.get("found")]
+
 
 @lru_cache()
 def get_person_service(
@@ -0,0 +1,120 @@
+import asyncio
+import bisect
+import logging
+from types import MappingProxyType
+from typing import (Awaitable, Callable, Generic, Iterable, List, Mapping,
+                    Optional, Tuple, TypeVar)
+
+from models.page import Page
+from services.pagination import decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _SnapshotData(Generic[T]):
+    """Неизменяемое содержимое снимка: список по возрастанию id и словарь по id."""
+
+    def __init__(self, items: Iterable[T], key: Callable[[T], str]):
+        self.items: Tuple[T, ...] = tuple(sorted(items, key=key))
+        self.ids: Tuple[str, ...] = tuple(key(item) for item in self.items)
+        self.by_id: Mapping[str, T] = MappingProxyType(dict(zip(self.ids, self.items)))
+
+
+class ReferenceSnapshot(Generic[T]):
+    """
+    Небольшой справочник (жанры и т.п.), целиком загруженный в память воркера.
+    Обновление собирает новый неизменяемый снимок и подменяет ссылку на него
+    одним присваиванием, поэтому читатели без блокировок видят либо старый,
+    либо новый снимок целиком. Пока снимок не загружен, ready == False и
+    сервис должен отвечать из ES и кеша, как обычно.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        load: Callable[[], Awaitable[Optional[Iterable[T]]]],
+        key: Callable[[T], str],
+    ):
+        self.name = name
+        self._load = load
+        self._key = key
+        self._data: Optional[_SnapshotData[T]] = None
+        self._changed: Optional[asyncio.Event] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._data is not None
+
+    def __len__(self) -> int:
+        data = self._data
+        return len(data.items) if data is not None else 0
+
+    def get(self, item_id: str) -> Optional[T]:
+        return self._data.by_id.get(item_id)
+
+    def get_many(self, item_ids: List[str]) -> List[T]:
+        """
+        Элементы в порядке запрошенных id без повторов, отсутствующие
+        пропускаются - так же, как в get_many_cached.
+        """
+        by_id = self._data.by_id
+        item_ids = list(dict.fromkeys(item_ids))
+        return [by_id[item_id] for item_id in item_ids if item_id in by_id]
+
+    def page(
+        self, page_size: int, page_number: int, cursor: Optional[str] = None
+    ) -> Page:
+        """
+        Страница в порядке возрастания id. Курсор совместим с курсором
+        из ES при сортировке по id: в нём id последнего элемента страницы.
+        """
+        data = self._data
+        if cursor:
+            sort_values = decode_cursor(cursor, 1)
+            start = bisect.bisect_right(data.ids, str(sort_values[-1]))
+        else:
+            start = (page_number - 1) * page_size
+        items = list(data.items[start : start + page_size])
+        next_cursor = None
+        if len(items) == page_size:
+            next_cursor = encode_cursor([self._key(items[-1])])
+        return Page(
+            items=items,
+            page_number=page_number,
+            page_size=page_size,
+            total=len(data.items),
+            next_cursor=next_cursor,
+        )
+
+    async def refresh(self) -> None:
+        """Загрузить справочник заново и атомарно подменить снимок."""
+        items = await self._load()
+        if items is None:
+            # Справочник не помещается в снимок: отвечаем из ES.
+            self._data = None
+            return
+        self._data = _SnapshotData(items, self._key)
+        logger.info("Snapshot %s refreshed: %s items", self.name, len(self))
+
+    def request_refresh(self) -> None:
+        """Обновить снимок, не дожидаясь таймера (например, по событию из ETL)."""
+        if self._changed is not None:
+            self._changed.set()
+
+    async def keep_fresh(self, interval: float) -> None:
+        """Загрузить снимок и обновлять его по таймеру и по запросу."""
+        self._changed = asyncio.Event()
+        while True:
+            self._changed.clear()
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to refresh snapshot %s", self.name)
+            try:
+                await asyncio.wait_for(self._changed.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
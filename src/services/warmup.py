@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Awaitable, Iterable, Optional
+
+import aioredis
+
+from core import config
+from core.metrics import WARMUP_DURATION
+from db import elastic, redis
+from services.film import get_film_service
+from services.genre import get_genre_service
+
+logger = logging.getLogger(__name__)
+
+# Сортировка и размер страницы по умолчанию в ручках списков:
+# прогреваются те же ключи кеша, что запрашивают клиенты. Поэтому аргументы
+# методов сервисов передаются так же, как в ручках, - позиционно.
+DEFAULT_FILM_SORT = "-imdb_rating"
+DEFAULT_PAGE_SIZE = 50
+
+# Блокировка прогрева при старте: прогревает один воркер из запущенных
+WARMUP_LOCK_KEY = "lock|warmup"
+
+# Длительность последнего прогрева в секундах
+last_warmup_duration: Optional[float] = None
+
+
+async def _gather_limited(coros: Iterable[Awaitable], limit: int) -> list:
+    """Выполнить корутины, не больше limit одновременно."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def _run(coro: Awaitable):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(_run(c) for c in coros))
+
+
+async def warm_up_cache(
+    film_pages: int = config.WARMUP_FILM_PAGES,
+    top_films: int = config.WARMUP_TOP_FILMS,
+    concurrency: int = config.WARMUP_CONCURRENCY,
+) -> float:
+    """
+    Прогрев кеша: все жанры, первые страницы списка фильмов для сортировки
+    по умолчанию и для каждого жанра, самые популярные фильмы по imdb_rating.
+    Возвращает длительность прогрева в секундах.
+    """
+    global last_warmup_duration
+
+    started = time.monotonic()
+    film_service = get_film_service(redis.redis, elastic.es)
+    genre_service = get_genre_service(redis.redis, elastic.es)
+
+    genres = []
+    page_number = 1
+    while True:
+        page = await genre_service.get_list(DEFAULT_PAGE_SIZE, page_number, None)
+        genres.extend(page.items)
+        if not page.items or page_number * DEFAULT_PAGE_SIZE >= page.total:
+            break
+        page_number += 1
+
+    # Первые страницы без фильтра нужны и для списка популярных фильмов.
+    top_pages = max(film_pages, math.ceil(top_films / DEFAULT_PAGE_SIZE))
+    pages = await _gather_limited(
+        (
+            film_service.get_list(
+                DEFAULT_FILM_SORT, DEFAULT_PAGE_SIZE, page_number, None, None
+            )
+            for page_number in range(1, top_pages + 1)
+        ),
+        concurrency,
+    )
+    await _gather_limited(
+        (
+            film_service.get_list(
+                DEFAULT_FILM_SORT, DEFAULT_PAGE_SIZE, page_number, genre.id, None
+            )
+            for genre in genres
+            for page_number in range(1, film_pages + 1)
+        ),
+        concurrency,
+    )
+
+    top_ids = [film.id for page in pages for film in page.items][:top_films]
+    await _gather_limited(
+        (film_service.get_by_id(film_id) for film_id in top_ids), concurrency
+    )
+
+    last_warmup_duration = time.monotonic() - started
+    WARMUP_DURATION.set(last_warmup_duration)
+    logger.info(
+        "Cache warm-up finished in %.2fs: %s genres, %s film pages, %s films",
+        last_warmup_duration,
+        len(genres),
+        top_pages + len(genres) * film_pages,
+        len(top_ids),
+    )
+    return last_warmup_duration
+
+
+async def warm_up_once() -> Optional[float]:
+    """
+    Прогрев кеша при старте воркера. Прогревает только воркер, взявший
+    блокировку: остальные, запущенные в течение WARMUP_LOCK_TTL секунд,
+    прогрев пропускают и не создают лишнюю нагрузку на ES.
+    """
+    acquired = await redis.redis.set(
+        WARMUP_LOCK_KEY,
+        "1",
+        expire=config.WARMUP_LOCK_TTL,
+        exist=redis.redis.SET_IF_NOT_EXIST,
+    )
+    if not acquired:
+        logger.info("Cache warm-up skipped: another worker is warming up")
+        return None
+    return await warm_up_cache()
+
+
+def log_warmup_error(task: "asyncio.Future") -> None:
+    """Колбэк задачи прогрева: ошибка фоновой задачи иначе не попадёт в лог."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Cache warm-up failed", exc_info=task.exception())
+
+
+async def _main() -> None:
+    redis.redis = await aioredis.create_redis_pool(
+        (config.REDIS_HOST, config.REDIS_PORT),
+        minsize=1,
+        maxsize=config.WARMUP_CONCURRENCY,
+    )
+    elastic.es = elastic.create_elastic()
+    try:
+        await warm_up_cache()
+    finally:
+        redis.redis.close()
+        await redis.redis.wait_closed()
+        await elastic.es.close()
+
+
+if __name__ == "__main__":
+    # Запуск из каталога src: python -m services.warmup
+    asyncio.run(_main())